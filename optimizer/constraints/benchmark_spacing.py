@@ -0,0 +1,93 @@
+"""
+Benchmark of the PairWiseSpacing Jacobian: sparse vectorized partials against the
+previous dense double-loop implementation.
+
+Run with: python -m wesl.optimizer.constraints.benchmark_spacing
+"""
+# External libraries
+import time
+
+import numpy as np
+import openmdao.api as om
+
+from wesl.optimizer.constraints.wind_farm_constraints import PairWiseSpacing
+
+
+def dense_spacing_partials(x, y):
+    '''Previous PairWiseSpacing.compute_partials: dense (n_pairs, n) matrices filled in a double loop'''
+    n = len(x)
+    n_pairs = n * (n - 1) // 2
+    row = 0
+    d_spacing_dx = np.zeros((n_pairs, n))
+    d_spacing_dy = np.zeros((n_pairs, n))
+    for i in range(n):
+        for j in range(i+1, n):
+            dx = x[i] - x[j]
+            dy = y[i] - y[j]
+            dist = np.sqrt(dx**2 + dy**2) + 1e-12
+            d_spacing_dx[row, i] = dx / dist
+            d_spacing_dx[row, j] = -dx / dist
+            d_spacing_dy[row, i] = dy / dist
+            d_spacing_dy[row, j] = -dy / dist
+            row += 1
+    return d_spacing_dx, d_spacing_dy
+
+
+def grid_layout(n_turbines, spacing=1000., seed=0):
+    side = int(np.ceil(np.sqrt(n_turbines)))
+    x, y = np.meshgrid(np.arange(side) * spacing, np.arange(side) * spacing)
+    rng = np.random.default_rng(seed)
+    return (x.ravel()[:n_turbines] + rng.normal(0, 50, n_turbines),
+            y.ravel()[:n_turbines] + rng.normal(0, 50, n_turbines))
+
+
+def benchmark(n_turbines=(80, 200, 1000), min_spacing=1110., max_dense_GB=2.):
+    """
+    Time one Jacobian evaluation of the sparse component and of the dense loop.
+
+    The dense reference is skipped when its two (n_pairs, n) matrices would need
+    more than `max_dense_GB`.
+
+    Returns
+    -------
+    results (list of dict): per turbine count, times [s], Jacobian memory [MB] and
+                            the max. difference of the nonzeros (when both ran)
+    """
+    results = []
+    for n in n_turbines:
+        x, y = grid_layout(n)
+        n_pairs = n * (n - 1) // 2
+
+        prob = om.Problem()
+        prob.model.add_subsystem('spacing', PairWiseSpacing(n_turbines=n, min_spacing=min_spacing),
+                                 promotes_inputs=['x', 'y'])
+        prob.setup()
+        comp = prob.model.spacing
+        J = {}
+        t0 = time.perf_counter()
+        comp.compute_partials(dict(x=x, y=y), J)
+        t_sparse = time.perf_counter() - t0
+
+        result = dict(n_turbines=n, n_pairs=n_pairs, sparse_s=t_sparse,
+                      sparse_MB=2 * 2 * n_pairs * 8 / 1024**2,
+                      dense_MB=2 * n_pairs * n * 8 / 1024**2,
+                      dense_s=None, max_abs_diff=None)
+
+        if result['dense_MB'] / 1024 <= max_dense_GB:
+            t0 = time.perf_counter()
+            d_dx, d_dy = dense_spacing_partials(x, y)
+            result['dense_s'] = time.perf_counter() - t0
+            rows = np.repeat(np.arange(n_pairs), 2)
+            cols = np.column_stack(comp.iu).ravel()
+            result['max_abs_diff'] = max(np.abs(d_dx[rows, cols] - J['spacing_violation', 'x']).max(),
+                                         np.abs(d_dy[rows, cols] - J['spacing_violation', 'y']).max())
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    print(f"{'n':>6} {'pairs':>8} {'sparse [s]':>11} {'dense [s]':>10} {'sparse [MB]':>12} {'dense [MB]':>11}")
+    for r in benchmark():
+        dense_s = f"{r['dense_s']:10.3f}" if r['dense_s'] is not None else f"{'skipped':>10}"
+        print(f"{r['n_turbines']:6d} {r['n_pairs']:8d} {r['sparse_s']:11.5f} {dense_s} "
+              f"{r['sparse_MB']:12.2f} {r['dense_MB']:11.1f}")
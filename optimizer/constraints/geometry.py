@@ -0,0 +1,285 @@
+# External libraries
+import os
+from hashlib import sha256
+
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+from shapely.geometry.polygon import orient
+
+
+def polygon_segments(vertices):
+    """
+    Boundary segments of a polygon, for `signed_distance`.
+
+    Parameters
+    ----------
+    vertices (float, np.array):  polygon vertices, shape (m, 2), closed or not, any orientation
+
+    Returns
+    -------
+    start (float, np.array):     segment start points, shape (m, 2)
+    edge (float, np.array):      segment vectors (end - start), shape (m, 2)
+    normal (float, np.array):    outward unit normals, shape (m, 2)
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    if len(vertices) > 1 and np.allclose(vertices[0], vertices[-1]):
+        vertices = vertices[:-1]
+    start = vertices
+    edge = np.roll(vertices, -1, axis=0) - vertices
+
+    # Outward normal is the edge rotated clockwise for counter-clockwise polygons
+    area = np.sum(start[:, 0] * edge[:, 1] - start[:, 1] * edge[:, 0]) / 2
+    normal = np.column_stack((edge[:, 1], -edge[:, 0])) * np.sign(area)
+    normal /= np.maximum(np.linalg.norm(normal, axis=1, keepdims=True), 1e-300)
+    return start, edge, normal
+
+
+def region_segments(region):
+    """
+    Boundary segments of a shapely Polygon or MultiPolygon with holes, for
+    `signed_distance`.
+
+    Exteriors are oriented counter-clockwise and holes clockwise, so the winding
+    number is 1 inside the region and 0 in holes and outside, and the outward
+    normals point out of the region (into the holes).
+    """
+    starts, edges = [], []
+    for polygon in getattr(region, 'geoms', [region]):
+        polygon = orient(polygon, 1.0)
+        for ring in (polygon.exterior, *polygon.interiors):
+            vertices = np.asarray(ring.coords)[:-1]
+            starts.append(vertices)
+            edges.append(np.roll(vertices, -1, axis=0) - vertices)
+    start, edge = np.vstack(starts), np.vstack(edges)
+    normal = np.column_stack((edge[:, 1], -edge[:, 0]))
+    normal /= np.maximum(np.linalg.norm(normal, axis=1, keepdims=True), 1e-300)
+    return start, edge, normal
+
+
+def as_region(polygons):
+    """
+    Shapely (Multi)Polygon of the union of polygons given as shapely geometries or
+    (m, 2) vertex arrays, so overlapping or adjacent areas become one region.
+    """
+    if hasattr(polygons, 'geom_type'):
+        polygons = [polygons]
+    elif isinstance(polygons, np.ndarray) and polygons.ndim == 2:
+        polygons = [polygons]
+    return shapely.unary_union([p if hasattr(p, 'geom_type') else Polygon(p) for p in polygons])
+
+
+def winding_number(x, y, start, edge):
+    """Winding number of points (x, y) around the closed boundary given by its segments, shape (n,)"""
+    px = np.asarray(x, dtype=float)[:, None]
+    py = np.asarray(y, dtype=float)[:, None]
+    y0 = start[:, 1]
+    y1 = y0 + edge[:, 1]
+    # > 0 if the point is left of the segment
+    side = edge[:, 0] * (py - y0) - edge[:, 1] * (px - start[:, 0])
+    upward = (y0 <= py) & (y1 > py) & (side > 0)
+    downward = (y0 > py) & (y1 <= py) & (side < 0)
+    return upward.sum(1) - downward.sum(1)
+
+
+def signed_distance(x, y, start, edge, normal, inside=None):
+    """
+    Signed distance of points to a polygon boundary (> 0 outside) and its gradient.
+
+    All points are projected on all segments in one broadcasted operation, so the
+    nearest point may be inside a segment or at a vertex; concave polygons are
+    handled by the winding number.
+
+    Parameters
+    ----------
+    x, y (float, np.array):      point coordinates, shape (n,)
+    start, edge, normal :        boundary segments from `polygon_segments`
+    inside (bool, np.array):     points known to be inside, default from the winding number
+
+    Returns
+    -------
+    distance (float, np.array):  signed distance, shape (n,)
+    gradient (float, np.array):  d(distance)/d(x, y), shape (n, 2); the outward
+                                 normal of the nearest segment for points on the boundary
+    """
+    points = np.column_stack((x, y)).astype(float)
+    if inside is None:
+        inside = winding_number(points[:, 0], points[:, 1], start, edge) != 0
+
+    # Nearest point on every segment, shape (n, m)
+    ox = points[:, 0, None] - start[:, 0]
+    oy = points[:, 1, None] - start[:, 1]
+    edge_len2 = np.maximum(np.sum(edge**2, axis=1), 1e-300)
+    t = np.clip((ox * edge[:, 0] + oy * edge[:, 1]) / edge_len2, 0., 1.)
+    ox -= t * edge[:, 0]
+    oy -= t * edge[:, 1]
+    dist2 = ox**2 + oy**2
+
+    nearest = np.argmin(dist2, axis=1)
+    rows = np.arange(len(points))
+    dist = np.sqrt(dist2[rows, nearest])
+    sign = np.where(inside, -1., 1.)
+
+    on_boundary = dist < 1e-9
+    offset = np.column_stack((ox[rows, nearest], oy[rows, nearest]))
+    gradient = np.where(on_boundary[:, None], normal[nearest],
+                        sign[:, None] * offset / np.maximum(dist, 1e-300)[:, None])
+    return sign * dist, gradient
+
+
+class SignedDistanceField():
+    '''
+    Signed distance to a polygon boundary, rasterized once and interpolated.
+
+    The exact distance (`signed_distance`) is evaluated on a regular grid covering
+    the polygon plus a margin. Queries are bilinear interpolations of the four
+    surrounding nodes, with the gradient of the interpolant, so their cost does not
+    depend on the number of vertices; points outside the grid fall back to the
+    exact kernel. The interpolation error is below about resolution/2 near
+    vertices and negligible along straight segments.
+
+    The raster can be kept in an .npz cache file, which is reused when it was built
+    for the same vertices, resolution and margin.
+
+    Parameters
+    ----------
+    vertices (float, np.array):  polygon vertices, shape (m, 2), or a shapely (Multi)Polygon
+    resolution (float):          grid spacing [m]
+    margin (float):              grid extent beyond the polygon [m], default 10 % of its size
+    cache_file (str):            optional .npz file for the raster
+
+    Usage
+    -----
+    sdf = SignedDistanceField(boundary, resolution=25., cache_file='revwind_sdf.npz')
+    distance, gradient = sdf(x, y)
+    '''
+
+    def __init__(self, vertices, resolution=25., margin=None, cache_file=None):
+        if hasattr(vertices, 'geom_type'):
+            self.segments = region_segments(vertices)
+            lo, hi = np.array(vertices.bounds[:2]), np.array(vertices.bounds[2:])
+            geometry_bytes = shapely.to_wkb(shapely.set_precision(vertices, 0.01))
+        else:
+            vertices = np.asarray(vertices, dtype=float)
+            self.segments = polygon_segments(vertices)
+            lo, hi = vertices.min(0), vertices.max(0)
+            geometry_bytes = np.round(vertices, 2).tobytes()
+        self.resolution = float(resolution)
+        if margin is None:
+            margin = 0.1 * np.max(hi - lo)
+        self.origin = lo - margin
+        self.shape = tuple(int(n) + 1 for n in np.ceil((hi - lo + 2 * margin) / self.resolution))
+
+        key = sha256(geometry_bytes + np.array([self.resolution, margin]).tobytes()).hexdigest()
+        self.field = self._load(cache_file, key)
+        if self.field is None:
+            self.field = self._rasterize()
+            if cache_file is not None:
+                np.savez(cache_file, field=self.field, key=key)
+
+    def _load(self, cache_file, key):
+        if cache_file is None or not os.path.exists(cache_file):
+            return None
+        with np.load(cache_file) as data:
+            if str(data['key']) != key:
+                return None
+            return data['field']
+
+    def _rasterize(self, chunk_size=20000):
+        gx = self.origin[0] + self.resolution * np.arange(self.shape[0])
+        gy = self.origin[1] + self.resolution * np.arange(self.shape[1])
+        X, Y = [g.ravel() for g in np.meshgrid(gx, gy, indexing='ij')]
+        field = np.empty(len(X))
+        for i0 in range(0, len(X), chunk_size):
+            field[i0:i0 + chunk_size], _ = signed_distance(X[i0:i0 + chunk_size], Y[i0:i0 + chunk_size],
+                                                           *self.segments)
+        return field.reshape(self.shape)
+
+    def __call__(self, x, y):
+        '''Signed distance (> 0 outside), shape (n,), and its gradient, shape (n, 2)'''
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        u = (x - self.origin[0]) / self.resolution
+        v = (y - self.origin[1]) / self.resolution
+        i = np.floor(u).astype(int)
+        j = np.floor(v).astype(int)
+        on_grid = (i >= 0) & (j >= 0) & (i < self.shape[0] - 1) & (j < self.shape[1] - 1)
+
+        distance = np.empty(len(x))
+        gradient = np.empty((len(x), 2))
+        if not on_grid.all():
+            distance[~on_grid], gradient[~on_grid] = signed_distance(x[~on_grid], y[~on_grid], *self.segments)
+
+        i, j = i[on_grid], j[on_grid]
+        fu, fv = u[on_grid] - i, v[on_grid] - j
+        f00 = self.field[i, j]
+        f10 = self.field[i + 1, j]
+        f01 = self.field[i, j + 1]
+        f11 = self.field[i + 1, j + 1]
+        distance[on_grid] = ((1 - fu) * (1 - fv) * f00 + fu * (1 - fv) * f10
+                             + (1 - fu) * fv * f01 + fu * fv * f11)
+        gradient[on_grid, 0] = ((1 - fv) * (f10 - f00) + fv * (f11 - f01)) / self.resolution
+        gradient[on_grid, 1] = ((1 - fu) * (f01 - f00) + fu * (f11 - f10)) / self.resolution
+        return distance, gradient
+
+
+class BoundaryDistance():
+    '''
+    Signed distance to a wind farm boundary (> 0 outside) and its gradient.
+
+    The boundary is a single polygon (`polygon_vertices`) or lease areas with holes
+    (`lease_areas`, see `as_region`). Distances are exact (`signed_distance`) or
+    interpolated from a raster when `sdf_resolution` is given (`SignedDistanceField`).
+    '''
+
+    def __init__(self, polygon_vertices=None, lease_areas=None, sdf_resolution=None, sdf_cache_file=None):
+        boundary = polygon_vertices
+        if lease_areas is not None:
+            boundary = as_region(lease_areas)
+            self.segments = region_segments(boundary)
+        else:
+            self.segments = polygon_segments(boundary)
+        self.sdf = None
+        if sdf_resolution is not None:
+            self.sdf = SignedDistanceField(boundary, resolution=sdf_resolution, cache_file=sdf_cache_file)
+
+    def __call__(self, x, y):
+        if self.sdf is not None:
+            return self.sdf(x, y)
+        return signed_distance(x, y, *self.segments)
+
+
+class ExclusionZones():
+    '''
+    Signed distance of points to the nearest of a set of exclusion zones (cable
+    corridors, wrecks, UXO areas, ...), > 0 outside all zones.
+
+    Overlapping zones are merged. A shapely STRtree gives the nearest zone of each
+    point, so only that zone's segments are evaluated and the cost per point does
+    not grow with the number of zones.
+
+    Parameters
+    ----------
+    zones (list):   zone polygons as (m, 2) vertex arrays or shapely geometries
+    '''
+
+    def __init__(self, zones):
+        region = as_region(zones)
+        self.zones = list(getattr(region, 'geoms', [region]))
+        self.segments = [region_segments(zone) for zone in self.zones]
+        self.tree = shapely.STRtree(self.zones)
+
+    def __call__(self, x, y):
+        '''Signed distance to the nearest zone, shape (n,), and its gradient, shape (n, 2)'''
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        points, zone_of = self.tree.query_nearest(shapely.points(x, y), all_matches=False)
+        nearest = np.empty(len(x), dtype=int)
+        nearest[points] = zone_of
+
+        distance = np.empty(len(x))
+        gradient = np.empty((len(x), 2))
+        for zone in np.unique(nearest):
+            idx = np.flatnonzero(nearest == zone)
+            distance[idx], gradient[idx] = signed_distance(x[idx], y[idx], *self.segments[zone])
+        return distance, gradient
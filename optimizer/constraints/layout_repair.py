@@ -0,0 +1,123 @@
+# External libraries
+import numpy as np
+from scipy.spatial import cKDTree
+
+from wesl.optimizer.constraints.geometry import BoundaryDistance, ExclusionZones
+
+
+def repair_layout(x, y, min_spacing, polygon_vertices=None, lease_areas=None, exclusion_zones=None,
+                  boundary_margin=0., relaxation=1., max_iter=1000, tol=1e-3):
+    """
+    Move turbines of an infeasible layout to the nearest feasible positions.
+
+    Each iteration, for all turbines at once:
+        1. every pair closer than min_spacing (from a KD-tree neighbour list) is
+           pushed apart along the line between them by `relaxation` times the
+           overlap, split between both turbines,
+        2. turbines inside an exclusion zone are pushed out of it,
+        3. turbines outside the boundary (or closer than boundary_margin to it) are
+           projected inside along the signed distance gradient.
+    The iterations stop when no constraint is violated by more than `tol` [m].
+    The boundary projection comes last, so the boundary has priority when the
+    area cannot hold the turbines at min_spacing. A feasible layout is returned
+    unchanged.
+
+    Parameters
+    ----------
+    x, y (float, np.array):         turbine coordinates
+    min_spacing (float):            minimum spacing [m]
+    polygon_vertices, lease_areas:  boundary, as in BoundaryConstraint
+    exclusion_zones (list):         polygons turbines must stay out of
+    boundary_margin (float):        distance the turbines are kept inside the boundary [m]
+    relaxation (float):             share of the overlap removed per iteration (0, 1]
+    max_iter (int):                 maximum number of iterations
+    tol (float):                    feasibility tolerance [m]
+
+    Returns
+    -------
+    x, y (float, np.array):         repaired coordinates
+    info (dict):                    iterations, remaining max. spacing, boundary and
+                                    exclusion violations [m], feasible flag and the
+                                    largest turbine displacement [m]
+    """
+    x0 = np.array(x, dtype=float)
+    y0 = np.array(y, dtype=float)
+    x, y = x0.copy(), y0.copy()
+    boundary = BoundaryDistance(polygon_vertices=polygon_vertices, lease_areas=lease_areas)
+    exclusions = ExclusionZones(exclusion_zones) if exclusion_zones else None
+
+    def project_inside(x, y, max_passes=5):
+        # Projecting past a vertex can end just outside a neighbouring segment, so repeat
+        for _ in range(max_passes):
+            distance, gradient = boundary(x, y)
+            outside = distance > -boundary_margin
+            if not outside.any():
+                break
+            shift = (distance[outside] + boundary_margin + tol / 2)[:, None] * gradient[outside]
+            x[outside] -= shift[:, 0]
+            y[outside] -= shift[:, 1]
+
+    for iteration in range(max_iter + 1):
+        coords = np.column_stack((x, y))
+        pairs = cKDTree(coords).query_pairs(min_spacing - tol, output_type='ndarray')
+        i, j = pairs[:, 0], pairs[:, 1]
+        delta = coords[i] - coords[j]
+        dist = np.linalg.norm(delta, axis=1)
+        spacing_violation = max(min_spacing - dist.min(), 0.) if len(pairs) else 0.
+        boundary_violation = max(boundary(x, y)[0].max() + boundary_margin, 0.)
+        exclusion_violation = 0.
+        if exclusions is not None:
+            distance, gradient = exclusions(x, y)
+            exclusion_violation = max(-distance.min(), 0.)
+        if max(spacing_violation, boundary_violation, exclusion_violation) <= tol or iteration == max_iter:
+            break
+
+        # Coincident turbines get an arbitrary separation direction
+        coincident = dist < 1e-9
+        delta[coincident] = np.column_stack((np.cos(i[coincident]), np.sin(i[coincident])))
+        dist[coincident] = 1.
+        push = (relaxation * (min_spacing - dist) / 2 / dist)[:, None] * delta
+        np.add.at(coords, i, push)
+        np.add.at(coords, j, -push)
+        x, y = coords[:, 0].copy(), coords[:, 1].copy()
+
+        if exclusions is not None:
+            inside = distance < 0
+            shift = (tol / 2 - distance[inside])[:, None] * gradient[inside]
+            x[inside] += shift[:, 0]
+            y[inside] += shift[:, 1]
+
+        project_inside(x, y)
+
+    info = dict(iterations=iteration,
+                spacing_violation=spacing_violation,
+                boundary_violation=boundary_violation,
+                exclusion_violation=exclusion_violation,
+                max_displacement=np.hypot(x - x0, y - y0).max())
+    info['feasible'] = max(info['spacing_violation'], info['boundary_violation'],
+                           info['exclusion_violation']) <= tol
+    return x, y, info
+
+
+def repair_problem(prob, min_spacing, x_name='x', y_name='y', **kwargs):
+    """
+    Pre-driver hook: repair the layout held in an OpenMDAO problem before run_driver.
+
+    Call after prob.setup() (and after setting the initial layout); the repaired
+    coordinates are written back with prob.set_val. kwargs are passed on to
+    `repair_layout` (boundary, exclusion zones, margin, ...).
+
+    Usage
+    -----
+    prob.setup()
+    repair_problem(prob, min_spacing=5*wind_turbines.diameter(), polygon_vertices=boundary)
+    prob.run_driver()
+
+    Returns
+    -------
+    info (dict): see `repair_layout`
+    """
+    x, y, info = repair_layout(prob.get_val(x_name), prob.get_val(y_name), min_spacing, **kwargs)
+    prob.set_val(x_name, x)
+    prob.set_val(y_name, y)
+    return info
@@ -1,7 +1,11 @@
 # External libraries
+from hashlib import sha256
+
 import numpy as np
 import openmdao.api as om
-from shapely.geometry import Point, Polygon
+from scipy.spatial import cKDTree
+
+from wesl.optimizer.constraints.geometry import BoundaryDistance, ExclusionZones
 
 
 class PairWiseSpacing(om.ExplicitComponent):
@@ -44,11 +48,12 @@ class PairWiseSpacing(om.ExplicitComponent):
         self.add_output('spacing_violation', shape=self.n_pairs,
                         desc='Pairwise spacing minus min_spacing')
 
-        # # Full sparsity for partials (not super efficient, but safe for now)
-        # rows = np.repeat(np.arange(self.n_pairs), 2)
-        # cols = []  # will populate in compute_partials
-        self.declare_partials(of='spacing_violation', wrt='x')
-        self.declare_partials(of='spacing_violation', wrt='y')
+        # Pair k = (i, j), i < j, only depends on turbines i and j: 2 nonzeros per row
+        self.iu = np.triu_indices(n, k=1)
+        rows = np.repeat(np.arange(self.n_pairs), 2)
+        cols = np.column_stack(self.iu).ravel()
+        self.declare_partials(of='spacing_violation', wrt='x', rows=rows, cols=cols)
+        self.declare_partials(of='spacing_violation', wrt='y', rows=rows, cols=cols)
 
     def compute(self, inputs, outputs):
         x = inputs['x']
@@ -83,27 +88,396 @@ class PairWiseSpacing(om.ExplicitComponent):
     def compute_partials(self, inputs, J):
         x = inputs['x']
         y = inputs['y']
-        n = len(x)
+        i, j = self.iu
+
+        dx = x[i] - x[j]
+        dy = y[i] - y[j]
+        dist = np.sqrt(dx**2 + dy**2) + 1e-12  # avoid /0
 
-        row = 0
+        # Values in the (row, col) order declared in setup: [d/d(turbine i), d/d(turbine j)] per pair
+        J['spacing_violation', 'x'] = np.column_stack((dx / dist, -dx / dist)).ravel()
+        J['spacing_violation', 'y'] = np.column_stack((dy / dist, -dy / dist)).ravel()
 
-        d_spacing_dx = np.zeros((self.n_pairs, n))
-        d_spacing_dy = np.zeros((self.n_pairs, n))
 
-        for i in range(n):
-            for j in range(i+1, n):
-                dx = x[i] - x[j]
-                dy = y[i] - y[j]
-                dist = np.sqrt(dx**2 + dy**2) + 1e-12  # avoid /0
+def row_blocks(coordinate, n_blocks):
+    """
+    Block labels for AggregatedSpacing: turbines split into `n_blocks` rows of
+    (about) equal size along a coordinate, e.g. y for east-west rows.
+    """
+    order = np.argsort(coordinate, kind='stable')
+    labels = np.empty(len(coordinate), dtype=int)
+    labels[order] = np.arange(len(coordinate)) * n_blocks // len(coordinate)
+    return labels
 
-                d_spacing_dx[row, i] = dx / dist
-                d_spacing_dx[row, j] = -dx / dist
-                d_spacing_dy[row, i] = dy / dist
-                d_spacing_dy[row, j] = -dy / dist
-                row += 1
 
-        J['spacing_violation', 'x'] = d_spacing_dx
-        J['spacing_violation', 'y'] = d_spacing_dy
+class AggregatedSpacing(om.ExplicitComponent):
+
+    """
+    Minimum spacing between turbines as a few smooth aggregated constraints.
+
+    PairWiseSpacing hands the optimizer n(n-1)/2 constraints. Here the pair spacings
+    are reduced to a smooth lower bound of their minimum (Kreisselmeier-Steinhauser
+    aggregate) over groups of pairs:
+
+        aggregation='ks':       one output, all pairs
+        aggregation='nearest':  n outputs, the pairs of each turbine with its n_neighbors
+                                nearest turbines (nearest neighbour)
+        aggregation='block':    one output per block (e.g. turbine rows, see row_blocks),
+                                the pairs with at least one turbine in the block
+
+    The KS aggregate of spacings s_k (normalized by min_spacing) is
+
+        KS = min(s) - 1/rho * log(sum(exp(-rho*(s_k - min(s)))))
+
+    which is never above the true minimum, so KS >= 0 is conservative; it tends to
+    the minimum as rho grows. The Jacobian pattern follows from the pairs in each
+    group and is declared in setup.
+
+    'ks' and 'block' aggregate all n(n-1)/2 pairs, so compute is O(n^2) and every
+    output depends on (nearly) every turbine. 'nearest' keeps the large-farm path
+    sparse: the neighbours come from a KD-tree k-nearest query on
+    `layout_coordinates` in setup, so a row has O(n_neighbors) nonzeros and compute
+    is linear in the number of turbines. Pairs that are not neighbours and come
+    closer than min_spacing are counted by `missed`; run the driver through
+    `run_active_set` to query the neighbours again when that happens.
+
+    Parameters:
+    ----------------------------------------------------------------------------------
+    Variable                      Description
+    x (float):                    wind turbine coordinates in the x axis
+    y (float):                    wind turbine coordinates in the y axis
+    n_turbines (int):             number of wind turbines
+    min_spacing (float):          minimum spacing in meters
+    aggregation (str):            'ks', 'nearest' or 'block'
+    rho (float):                  KS aggregation parameter
+    blocks (int, np.array):       block label per turbine (aggregation='block')
+    layout_coordinates (float):   x and y coordinates, shape (2, n), of the neighbour
+                                  query (aggregation='nearest')
+    n_neighbors (int):            neighbours per turbine (aggregation='nearest')
+    spacing_violation (float):    aggregated spacing minus min_spacing (>= 0 feasible)
+
+    Usage:
+    ----------------------------------------------------------------------------------
+    prob.model.add_subsystem('Spacing_Constraint',
+                         AggregatedSpacing(n_turbines = 63,
+                                           min_spacing = 5*wind_turbines.diameter(),
+                                           aggregation = 'nearest',
+                                           layout_coordinates = np.array([x, y])),
+                         promotes_inputs=['x', 'y'])
+    prob.model.add_constraint('Spacing_Constraint.spacing_violation', lower=0.0)
+    """
+
+    def initialize(self):
+        self.options.declare('n_turbines', types=int, desc='Number of turbines')
+        self.options.declare('min_spacing', types=float, desc='Minimum spacing in meters')
+        self.options.declare('aggregation', default='ks', values=['ks', 'nearest', 'block'],
+                             desc='Groups of turbine pairs aggregated into one constraint')
+        self.options.declare('rho', default=50., types=(float, int),
+                             desc='KS aggregation parameter (spacings normalized by min_spacing)')
+        self.options.declare('blocks', default=None, types=np.ndarray, allow_none=True,
+                             desc='Block label per turbine for aggregation="block"')
+        self.options.declare('layout_coordinates', default=None, types=np.ndarray, allow_none=True,
+                             desc='Coordinates of the neighbour query for aggregation="nearest", shape (2, n)')
+        self.options.declare('n_neighbors', default=8, types=int,
+                             desc='Neighbours per turbine for aggregation="nearest"')
+
+    def setup(self):
+        n = self.options['n_turbines']
+        aggregation = self.options['aggregation']
+        self.add_input('x', shape=n, desc='Turbine x-coordinates')
+        self.add_input('y', shape=n, desc='Turbine y-coordinates')
+
+        if aggregation == 'nearest':
+            if self.options['layout_coordinates'] is None:
+                raise ValueError("aggregation='nearest' needs the layout_coordinates option")
+            coords = np.asarray(self.options['layout_coordinates'], dtype=float).T
+            k = min(self.options['n_neighbors'], n - 1)
+            _, neighbors = cKDTree(coords).query(coords, k=k + 1)
+            ij = np.sort(np.column_stack((np.repeat(np.arange(n), k), neighbors[:, 1:].ravel())), axis=1)
+            ij = np.unique(ij[ij[:, 0] != ij[:, 1]], axis=0)
+            self.pair_i, self.pair_j = ij[:, 0], ij[:, 1]
+            self.neighbors = set((ij[:, 0] * n + ij[:, 1]).tolist())
+        else:
+            self.pair_i, self.pair_j = np.triu_indices(n, k=1)
+        i, j = self.pair_i, self.pair_j
+        pairs = np.arange(len(i))
+
+        # Incidence of turbine pairs in the aggregated groups
+        if aggregation == 'ks':
+            group, pair = np.zeros(len(pairs), dtype=int), pairs
+        elif aggregation == 'nearest':
+            group, pair = np.concatenate((i, j)), np.concatenate((pairs, pairs))
+        else:
+            if self.options['blocks'] is None:
+                raise ValueError("aggregation='block' needs the blocks option")
+            labels = np.unique(self.options['blocks'], return_inverse=True)[1].ravel()
+            cross = labels[i] != labels[j]
+            group = np.concatenate((labels[i], labels[j][cross]))
+            pair = np.concatenate((pairs, pairs[cross]))
+
+        order = np.argsort(group, kind='stable')
+        self.group, self.pair = group[order], pair[order]
+        self.n_groups = self.group[-1] + 1
+        self.starts = np.flatnonzero(np.r_[True, np.diff(self.group) > 0])
+
+        self.add_output('spacing_violation', shape=self.n_groups,
+                        desc='Aggregated pairwise spacing minus min_spacing')
+
+        # Each incidence (group, pair) contributes to (group, i) and (group, j)
+        keys = np.column_stack((self.group * n + i[self.pair], self.group * n + j[self.pair])).ravel()
+        unique_keys, self.jac_index = np.unique(keys, return_inverse=True)
+        self.jac_index = self.jac_index.ravel()
+        rows, cols = np.divmod(unique_keys, n)
+        self.declare_partials(of='spacing_violation', wrt='x', rows=rows, cols=cols)
+        self.declare_partials(of='spacing_violation', wrt='y', rows=rows, cols=cols)
+
+    def missed(self, x, y):
+        '''Number of pairs closer than min_spacing that are not aggregated (aggregation='nearest')'''
+        if self.options['aggregation'] != 'nearest':
+            return 0
+        n = self.options['n_turbines']
+        pairs = cKDTree(np.column_stack((x.real, y.real))).query_pairs(self.options['min_spacing'],
+                                                                       output_type='ndarray')
+        keys = np.sort(pairs, axis=1) @ np.array([n, 1]) if len(pairs) else np.empty(0, dtype=int)
+        return sum(key not in self.neighbors for key in keys.tolist())
+
+    def _pairs(self, x, y):
+        i, j = self.pair_i, self.pair_j
+        dx = x[i] - x[j]
+        dy = y[i] - y[j]
+        return dx, dy, np.sqrt(dx**2 + dy**2) + 1e-12  # avoid /0
+
+    def _ks(self, dist):
+        # KS minimum of the normalized spacings per group and the weight of each incidence
+        min_spacing, rho = self.options['min_spacing'], self.options['rho']
+        s = (dist[self.pair] - min_spacing) / min_spacing
+        s_min = np.minimum.reduceat(s, self.starts)
+        e = np.exp(-rho * (s - s_min[self.group]))
+        e_sum = np.bincount(self.group, weights=e, minlength=self.n_groups)
+        ks = s_min - np.log(e_sum) / rho
+        return ks, e / e_sum[self.group]
+
+    def compute(self, inputs, outputs):
+        _, _, dist = self._pairs(inputs['x'], inputs['y'])
+        ks, _ = self._ks(dist)
+        outputs['spacing_violation'] = self.options['min_spacing'] * ks
+
+    def compute_partials(self, inputs, J):
+        dx, dy, dist = self._pairs(inputs['x'], inputs['y'])
+        _, weight = self._ks(dist)
+        for name, d in (('x', dx), ('y', dy)):
+            # d(spacing)/d(turbine i) = d/dist, d/d(turbine j) = -d/dist for each incidence
+            ddist = weight * (d / dist)[self.pair]
+            values = np.column_stack((ddist, -ddist)).ravel()
+            J['spacing_violation', name] = np.bincount(self.jac_index, weights=values)
+
+
+class ActiveSetSpacing(om.ExplicitComponent):
+
+    """
+    Minimum spacing constraint on the turbine pairs closer than k*min_spacing.
+
+    Only pairs closer than `radius_factor` minimum spacings are constrained. The
+    candidate pairs are found in setup by a KD-tree query on `layout_coordinates`,
+    within candidate_factor*radius_factor*min_spacing, and each gets an output
+    slot. A slot holds min(distance, radius) - min_spacing: a pair beyond the
+    radius is inactive (constant value, zero gradient) and becomes active again,
+    without a jump, when it comes back. If there are more candidates than
+    `max_pairs`, the closest ones are kept (see `n_dropped`); dropped pairs that
+    come within the radius count as missed.
+
+    Within one setup the slots are fixed, so the Jacobian is sparse with a fixed
+    pattern: two nonzeros per slot and coordinate (rows=slot, cols=[i, j]), and
+    compute and compute_partials are linear in the number of turbines. Pairs
+    without a slot that come within the radius are counted in `n_missed`. The
+    re-activation policy is `run_active_set`: it runs the driver in segments of
+    `refresh_every` iterations and, when a segment ends with missed pairs,
+    re-queries the candidates on the current layout and sets the problem up again
+    before continuing. A run cannot end with an unconstrained pair within the
+    radius: if maxiter is used up with missed pairs, an AnalysisError is raised.
+
+    Parameters:
+    ----------------------------------------------------------------------------------
+    Variable                      Description
+    x (float):                    wind turbine coordinates in the x axis
+    y (float):                    wind turbine coordinates in the y axis
+    n_turbines (int):             number of wind turbines
+    min_spacing (float):          minimum spacing in meters
+    layout_coordinates (float):   x and y start coordinates, shape (2, n), for the candidate pairs
+    radius_factor (float):        search radius in minimum spacings
+    candidate_factor (float):     candidate radius relative to the search radius
+    max_pairs (int):              output slots, default the number of candidate pairs
+    spacing_violation (float):    min(spacing, radius) minus min_spacing per slot (>= 0 feasible)
+
+    Usage:
+    ----------------------------------------------------------------------------------
+    prob.model.add_subsystem('Spacing_Constraint',
+                         ActiveSetSpacing(n_turbines = 63,
+                                          min_spacing = 5*wind_turbines.diameter(),
+                                          layout_coordinates = np.array([x, y]),
+                                          radius_factor = 2.0),
+                         promotes_inputs=['x', 'y'])
+    prob.model.add_constraint('Spacing_Constraint.spacing_violation', lower=0.0)
+    prob.setup()
+    run_active_set(prob, prob.model.Spacing_Constraint)     # instead of prob.run_driver()
+    """
+
+    def initialize(self):
+        self.options.declare('n_turbines', types=int, desc='Number of turbines')
+        self.options.declare('min_spacing', types=float, desc='Minimum spacing in meters')
+        self.options.declare('layout_coordinates', types=np.ndarray,
+                             desc='Start coordinates, shape (2, n_turbines)')
+        self.options.declare('radius_factor', default=2., types=(float, int),
+                             desc='Active-set search radius in minimum spacings')
+        self.options.declare('candidate_factor', default=1.5, types=(float, int),
+                             desc='Candidate radius relative to the search radius')
+        self.options.declare('max_pairs', default=None, types=int, allow_none=True,
+                             desc='Number of constraint slots')
+
+    def setup(self):
+        n = self.options['n_turbines']
+        self.add_input('x', shape=n, desc='Turbine x-coordinates')
+        self.add_input('y', shape=n, desc='Turbine y-coordinates')
+
+        self.radius = self.options['radius_factor'] * self.options['min_spacing']
+        coords = np.asarray(self.options['layout_coordinates'], dtype=float).T
+        assert coords.shape == (n, 2), 'layout_coordinates must have shape (2, n_turbines)'
+        pairs = cKDTree(coords).query_pairs(self.options['candidate_factor'] * self.radius,
+                                            output_type='ndarray')
+        pairs = np.sort(pairs, axis=1) if len(pairs) else np.empty((0, 2), dtype=int)
+        dist = np.linalg.norm(coords[pairs[:, 0]] - coords[pairs[:, 1]], axis=1)
+        pairs = pairs[np.argsort(dist, kind='stable')]
+
+        self.max_pairs = self.options['max_pairs']
+        if self.max_pairs is None:
+            self.max_pairs = max(len(pairs), 1)
+        self.n_dropped = max(len(pairs) - self.max_pairs, 0)
+        pairs = pairs[:self.max_pairs]
+        self.n_candidates = len(pairs)
+        self.candidates = set((pairs[:, 0] * n + pairs[:, 1]).tolist())
+        self.n_missed = 0
+
+        # Slot -> pair (i, j); unused slots (max_pairs > candidates) point at turbines 0 and 1
+        self.slot_i = np.zeros(self.max_pairs, dtype=int)
+        self.slot_j = np.full(self.max_pairs, min(1, n - 1), dtype=int)
+        self.slot_i[:len(pairs)] = pairs[:, 0]
+        self.slot_j[:len(pairs)] = pairs[:, 1]
+
+        self.add_output('spacing_violation', shape=self.max_pairs,
+                        desc='Spacing (clipped at the radius) minus min_spacing of the candidate pairs')
+        slots = np.arange(self.max_pairs)
+        self.declare_partials(of='spacing_violation', wrt=['x', 'y'],
+                              rows=np.repeat(slots, 2),
+                              cols=np.column_stack((self.slot_i, self.slot_j)).ravel())
+
+    def missed(self, x, y):
+        '''Number of pairs within the radius that have no slot'''
+        n = self.options['n_turbines']
+        pairs = cKDTree(np.column_stack((x.real, y.real))).query_pairs(self.radius, output_type='ndarray')
+        keys = np.sort(pairs, axis=1) @ np.array([n, 1]) if len(pairs) else np.empty(0, dtype=int)
+        return sum(key not in self.candidates for key in keys.tolist())
+
+    def compute(self, inputs, outputs):
+        x, y = inputs['x'], inputs['y']
+        min_spacing = self.options['min_spacing']
+        i, j = self.slot_i, self.slot_j
+
+        dist = np.sqrt((x[i] - x[j])**2 + (y[i] - y[j])**2)
+        dist[self.n_candidates:] = self.radius
+        outputs['spacing_violation'] = np.where(dist.real < self.radius, dist, self.radius) - min_spacing
+
+        self.n_missed = self.missed(x, y)
+
+    def compute_partials(self, inputs, J):
+        x, y = inputs['x'], inputs['y']
+        i, j = self.slot_i, self.slot_j
+
+        dx = x[i] - x[j]
+        dy = y[i] - y[j]
+        dist = np.sqrt(dx**2 + dy**2) + 1e-12  # avoid /0
+        # Inactive (beyond the radius) and unused slots have zero gradient
+        active = dist < self.radius
+        active[self.n_candidates:] = False
+        for name, d in (('x', dx), ('y', dy)):
+            ddist = np.where(active, d / dist, 0.)
+            J['spacing_violation', name] = np.column_stack((ddist, -ddist)).ravel()
+
+
+def run_active_set(prob, spacing, refresh_every=5):
+    """
+    Run the driver of a problem with an ActiveSetSpacing constraint (or an
+    AggregatedSpacing with aggregation='nearest'), re-activating the pairs that come
+    within its radius without a slot (closer than min_spacing without being
+    neighbours).
+
+    The driver runs in segments (within the driver's maxiter), the first of
+    `refresh_every` iterations. After a segment with missed pairs, the candidate
+    pairs are queried again on the current layout
+    (spacing.options['layout_coordinates']) and the problem is set up again, with
+    the design variables restored, so the next segment constrains them; the
+    segment length goes back to `refresh_every`. After a segment without missed
+    pairs it doubles, so a stable active set costs few optimizer restarts. The run
+    ends when a segment converges with no missed pairs.
+
+    Values set with prob.set_val on inputs that are not design variables are lost
+    at a new setup; set them with set_input_defaults before prob.setup().
+
+    Parameters
+    ----------
+    prob :                  problem, after prob.setup()
+    spacing :               its ActiveSetSpacing (or nearest AggregatedSpacing) component
+    refresh_every (int):    driver iterations between re-activation checks
+
+    Returns
+    -------
+    result of the last prob.run_driver()
+
+    Raises
+    ------
+    om.AnalysisError:       maxiter is used up with missed pairs
+    """
+    # ScipyOptimizeDriver copies maxiter into opt_settings at its first run, where it overrides the option
+    opt_settings = getattr(prob.driver, 'opt_settings', {})
+    user_maxiter = opt_settings.get('maxiter')
+    maxiter = prob.driver.options['maxiter'] if user_maxiter is None else user_maxiter
+    iterations = 0
+    length = refresh_every
+    try:
+        while True:
+            segment = min(length, maxiter - iterations)
+            prob.driver.options['maxiter'] = segment
+            opt_settings.pop('maxiter', None)
+            result = prob.run_driver()
+            # Optimizer iterations of a ScipyOptimizeDriver run (scipy result), else the model evaluations
+            scipy_result = getattr(prob.driver, '_scipy_optimize_result', None)
+            done = getattr(scipy_result, 'nit', None) or prob.driver.iter_count
+            iterations += done
+
+            x, y = spacing.get_val('x'), spacing.get_val('y')
+            missed = spacing.missed(x, y)
+            if not missed:
+                converged = (result.success if hasattr(result, 'success') else not result) and done < segment
+                if converged or iterations >= maxiter:
+                    return result
+                length *= 2
+                continue
+            if iterations >= maxiter:
+                raise om.AnalysisError(f'{spacing.msginfo}: {missed} turbine pairs are missed (not constrained) '
+                                       f'after {iterations} iterations')
+
+            # Re-activation: new candidate pairs around the current layout
+            design_vars = {name: np.array(prob.get_val(name))
+                           for name in prob.model.get_design_vars(get_sizes=False)}
+            spacing.options['layout_coordinates'] = np.array([x, y])
+            length = refresh_every
+            prob.setup()
+            for name, value in design_vars.items():
+                prob.set_val(name, value)
+    finally:
+        prob.driver.options['maxiter'] = maxiter
+        opt_settings.pop('maxiter', None)
+        if user_maxiter is not None:
+            opt_settings['maxiter'] = user_maxiter
 
 
 class BoundaryConstraint(om.ExplicitComponent):
@@ -112,11 +486,34 @@ class BoundaryConstraint(om.ExplicitComponent):
     Constraint: ensure turbines remain within a given polygon boundary.
     Returns <= 0 if inside, > 0 if outside.
 
+    The constraint is the signed distance to the nearest point of the boundary
+    (on a segment or at a vertex), so its gradient is the unit vector from that
+    point to the turbine (outside) or its opposite (inside). Each output only
+    depends on its own turbine, so the partials are declared diagonal.
+
+    The boundary segments are precomputed in setup and all turbines are projected
+    on all segments in one numpy operation (see `geometry.signed_distance`);
+    inside/outside comes from the winding number, so concave boundaries work.
+
+    For detailed boundaries (many vertices) or very large farms set sdf_resolution:
+    the signed distance is then rasterized once in setup and each query is a
+    bilinear interpolation (see `geometry.SignedDistanceField`), optionally cached
+    in sdf_cache_file.
+
+    Lease areas made of several polygons, possibly with holes, are given as
+    lease_areas (shapely geometries or vertex arrays; they are merged, so adjacent
+    areas form one region). Exclusion zones (cable corridors, wrecks, UXO areas)
+    add a second output, exclusion_cons, with the distance into the nearest zone
+    (<= 0 outside all zones); the nearest zone comes from a spatial index, so each
+    turbine has one output regardless of the number of zones.
+
     Parameters:
     ----------------------------------------------------------------------------------
     Variable                                Description
     polygon_vertices (float, np.array):     boundaries of the wind farm
     number_of_turbines (int):               number of wind turbines
+    lease_areas (list):                     lease area polygons, replaces polygon_vertices
+    exclusion_zones (list):                 polygons turbines must stay out of
 
     Usage:
     ----------------------------------------------------------------------------------
@@ -143,6 +540,28 @@ class BoundaryConstraint(om.ExplicitComponent):
             "number_of_turbines", 
             types=int,
             desc='Number of wind turbines in the wind farm')
+        self.options.declare(
+            'sdf_resolution',
+            default=None,
+            types=(float, int),
+            allow_none=True,
+            desc='Grid spacing of the signed distance raster in meters (None: exact distance)')
+        self.options.declare(
+            'sdf_cache_file',
+            default=None,
+            types=str,
+            allow_none=True,
+            desc='.npz file the signed distance raster is kept in')
+        self.options.declare(
+            'lease_areas',
+            default=None,
+            allow_none=True,
+            desc='Lease area polygons (vertex arrays or shapely geometries, with holes)')
+        self.options.declare(
+            'exclusion_zones',
+            default=None,
+            allow_none=True,
+            desc='Exclusion zone polygons (vertex arrays or shapely geometries)')
 
     def setup(self):
         n_wt = self.options["number_of_turbines"]
@@ -151,15 +570,156 @@ class BoundaryConstraint(om.ExplicitComponent):
         self.add_input('y', shape=n_wt, desc='Turbine y-coordinates')
         self.add_output('boundary_cons', shape=n_wt, desc='Boundary constraint per turbine')
 
-        self.declare_partials('*', '*', method='fd')
+        self.boundary = BoundaryDistance(polygon_vertices=self.options['polygon_vertices'],
+                                         lease_areas=self.options['lease_areas'],
+                                         sdf_resolution=self.options['sdf_resolution'],
+                                         sdf_cache_file=self.options['sdf_cache_file'])
+        self.declare_partials('boundary_cons', ['x', 'y'], rows=np.arange(n_wt), cols=np.arange(n_wt))
+
+        self.exclusions = None
+        if self.options['exclusion_zones']:
+            self.exclusions = ExclusionZones(self.options['exclusion_zones'])
+            self.add_output('exclusion_cons', shape=n_wt, desc='Distance into the nearest exclusion zone per turbine')
+            self.declare_partials('exclusion_cons', ['x', 'y'], rows=np.arange(n_wt), cols=np.arange(n_wt))
 
     def compute(self, inputs, outputs):
-        poly = Polygon(self.options['polygon_vertices'])
-        points = [Point(xi, yi) for xi, yi in zip(inputs['x'], inputs['y'])]
+        outputs['boundary_cons'], _ = self.boundary(inputs['x'], inputs['y'])
+        if self.exclusions is not None:
+            distance, _ = self.exclusions(inputs['x'], inputs['y'])
+            outputs['exclusion_cons'] = -distance
+
+    def compute_partials(self, inputs, J):
+        _, gradient = self.boundary(inputs['x'], inputs['y'])
+        J['boundary_cons', 'x'] = gradient[:, 0]
+        J['boundary_cons', 'y'] = gradient[:, 1]
+        if self.exclusions is not None:
+            _, gradient = self.exclusions(inputs['x'], inputs['y'])
+            J['exclusion_cons', 'x'] = -gradient[:, 0]
+            J['exclusion_cons', 'y'] = -gradient[:, 1]
 
-        outputs['boundary_cons'] = np.array([
-            poly.exterior.distance(pt) if not poly.contains(pt)
-            else -poly.exterior.distance(pt)
-            for pt in points
-        ])
 
+
+class LayoutGeometry(om.ExplicitComponent):
+
+    """
+    Spacing and boundary constraints of a layout from one shared geometry evaluation.
+
+    PairWiseSpacing and BoundaryConstraint each recompute the layout geometry from
+    the same x/y. This component computes the pair distances and the boundary (and
+    exclusion zone) distances with their gradients once per layout and exposes both
+    constraints, with the sparse Jacobians of PairWiseSpacing (2 nonzeros per pair)
+    and BoundaryConstraint (diagonal). The geometry is cached on a hash of the
+    coordinates, so compute and compute_partials at the same point, and repeated
+    driver calls, evaluate it once.
+
+    Parameters:
+    ----------------------------------------------------------------------------------
+    Variable                                Description
+    n_turbines (int):                       number of wind turbines
+    min_spacing (float):                    minimum spacing in meters
+    polygon_vertices (float, np.array):     boundaries of the wind farm
+    lease_areas, exclusion_zones, sdf_resolution, sdf_cache_file:  as in BoundaryConstraint
+    spacing_violation (float):              pairwise spacing minus min_spacing (>= 0 feasible)
+    boundary_cons (float):                  signed distance to the boundary (<= 0 feasible)
+    exclusion_cons (float):                 distance into the nearest exclusion zone (<= 0 feasible)
+
+    Usage:
+    ----------------------------------------------------------------------------------
+    prob.model.add_subsystem('Layout_Geometry',
+                         LayoutGeometry(n_turbines = 63,
+                                        min_spacing = 5*wind_turbines.diameter(),
+                                        polygon_vertices = boundary),
+                         promotes_inputs=['x', 'y'])
+    prob.model.add_constraint('Layout_Geometry.spacing_violation', lower=0.0)
+    prob.model.add_constraint('Layout_Geometry.boundary_cons', upper=0.0)
+    """
+
+    def initialize(self):
+        self.options.declare('n_turbines', types=int, desc='Number of turbines')
+        self.options.declare('min_spacing', types=float, desc='Minimum spacing in meters')
+        self.options.declare('polygon_vertices', default=None, types=np.ndarray, allow_none=True,
+                             desc='Polygon vertices as an array of shape (m, 2)')
+        self.options.declare('lease_areas', default=None, allow_none=True,
+                             desc='Lease area polygons (vertex arrays or shapely geometries, with holes)')
+        self.options.declare('exclusion_zones', default=None, allow_none=True,
+                             desc='Exclusion zone polygons (vertex arrays or shapely geometries)')
+        self.options.declare('sdf_resolution', default=None, types=(float, int), allow_none=True,
+                             desc='Grid spacing of the signed distance raster in meters (None: exact distance)')
+        self.options.declare('sdf_cache_file', default=None, types=str, allow_none=True,
+                             desc='.npz file the signed distance raster is kept in')
+
+    def setup(self):
+        n = self.options['n_turbines']
+        self.add_input('x', shape=n, desc='Turbine x-coordinates')
+        self.add_input('y', shape=n, desc='Turbine y-coordinates')
+
+        self.iu = np.triu_indices(n, k=1)
+        n_pairs = len(self.iu[0])
+        self.add_output('spacing_violation', shape=n_pairs, desc='Pairwise spacing minus min_spacing')
+        rows = np.repeat(np.arange(n_pairs), 2)
+        cols = np.column_stack(self.iu).ravel()
+        self.declare_partials('spacing_violation', ['x', 'y'], rows=rows, cols=cols)
+
+        self.boundary = BoundaryDistance(polygon_vertices=self.options['polygon_vertices'],
+                                         lease_areas=self.options['lease_areas'],
+                                         sdf_resolution=self.options['sdf_resolution'],
+                                         sdf_cache_file=self.options['sdf_cache_file'])
+        self.add_output('boundary_cons', shape=n, desc='Boundary constraint per turbine')
+        self.declare_partials('boundary_cons', ['x', 'y'], rows=np.arange(n), cols=np.arange(n))
+
+        self.exclusions = None
+        if self.options['exclusion_zones']:
+            self.exclusions = ExclusionZones(self.options['exclusion_zones'])
+            self.add_output('exclusion_cons', shape=n, desc='Distance into the nearest exclusion zone per turbine')
+            self.declare_partials('exclusion_cons', ['x', 'y'], rows=np.arange(n), cols=np.arange(n))
+
+        self._key = None
+        self._geometry = None
+        self.n_evaluations = 0
+
+    def geometry(self, x, y):
+        """
+        Geometry of a layout, evaluated once per distinct coordinates.
+
+        Returns
+        -------
+        dict with pair differences dx, dy and distances dist (upper-triangle pair
+        order), boundary distance/gradient and, with exclusion zones, exclusion
+        distance/gradient
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        key = sha256(x.tobytes() + y.tobytes()).digest()
+        if key == self._key:
+            return self._geometry
+
+        i, j = self.iu
+        dx = x[i] - x[j]
+        dy = y[i] - y[j]
+        geometry = dict(dx=dx, dy=dy, dist=np.sqrt(dx**2 + dy**2))
+        geometry['boundary'], geometry['boundary_gradient'] = self.boundary(x, y)
+        if self.exclusions is not None:
+            geometry['exclusion'], geometry['exclusion_gradient'] = self.exclusions(x, y)
+
+        self._key, self._geometry = key, geometry
+        self.n_evaluations += 1
+        return geometry
+
+    def compute(self, inputs, outputs):
+        geometry = self.geometry(inputs['x'], inputs['y'])
+        outputs['spacing_violation'] = geometry['dist'] - self.options['min_spacing']
+        outputs['boundary_cons'] = geometry['boundary']
+        if self.exclusions is not None:
+            outputs['exclusion_cons'] = -geometry['exclusion']
+
+    def compute_partials(self, inputs, J):
+        geometry = self.geometry(inputs['x'], inputs['y'])
+        dist = geometry['dist'] + 1e-12  # avoid /0
+        for name, d in (('x', geometry['dx']), ('y', geometry['dy'])):
+            J['spacing_violation', name] = np.column_stack((d / dist, -d / dist)).ravel()
+
+        J['boundary_cons', 'x'] = geometry['boundary_gradient'][:, 0]
+        J['boundary_cons', 'y'] = geometry['boundary_gradient'][:, 1]
+        if self.exclusions is not None:
+            J['exclusion_cons', 'x'] = -geometry['exclusion_gradient'][:, 0]
+            J['exclusion_cons', 'y'] = -geometry['exclusion_gradient'][:, 1]
@@ -786,7 +786,7 @@ def OBEW(G_base, capacity=8, weightfun=plain_length,
 
         # choose between the low or high corners
         if store[0][0] < savings or store[1][0] < savings:
-            loNotHi = store[0][0] < store[1][0]
+            loNotHi = bool(store[0][0] < store[1][0])
             cost, path, LoNotHi, direct, shift = store[not loNotHi]
             warn(f'({depth}) '
                  f'take: {n2s(*store[not loNotHi][1], goal_)} (@{cost:.0f}), '
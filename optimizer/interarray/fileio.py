@@ -28,6 +28,26 @@ def utm_from_latlonstr(entries):
     return utm_out
 
 
+def forbidden_zones_from_sheet(ws, rotation=None):
+    '''Polygons of a 'Forbidden Zones' sheet: x (m), y (m) and a zone label
+    per row; the rows with the same label (or all rows, if there are
+    no labels) are the vertices of one zone. Returns a list of (k, 2) arrays.'''
+    zones = {}
+    for x, y, label in ws.iter_rows(min_row=3, min_col=1, max_col=3,
+                                    values_only=True):
+        if x is None or y is None:
+            continue
+        zones.setdefault(label, []).append((x, y))
+    polygons = []
+    for vertices in zones.values():
+        vertices = np.array(vertices, dtype=float)
+        if rotation is not None:
+            vertices = rotate(vertices, rotation)
+        if len(vertices) >= 3:
+            polygons.append(vertices)
+    return polygons
+
+
 def file2graph(filename, rotation=None):
     '''filename is a Matlab .mat file or an Excel
     spreadsheet in the proper format'''
@@ -60,8 +80,9 @@ def file2graph(filename, rotation=None):
                            'WT coordinates', 'Forbidden Zones']:
                 continue
             if key == 'Forbidden Zones':
-                if ws['A3'].value is not None:
-                    print('Forbidden Zones not yet implemented.')
+                zones = forbidden_zones_from_sheet(ws, rotation)
+                if zones:
+                    data[key] = zones
                 continue
             for cell, header in (('A2', 'x (m)'),
                                  ('B2', 'y (m)')):
@@ -112,6 +133,8 @@ def file2graph(filename, rotation=None):
                  VertexC=np.vstack((WTcoords.T, OSScoords.T[::-1])),
                  boundary=boundary,
                  name=fpath.stem)
+    if 'Forbidden Zones' in data:
+        G.graph['exclusions'] = data['Forbidden Zones']
     G.add_nodes_from(((n, {'label': F[n], 'type': 'wtg'})
                       for n in range(N)))
     G.add_nodes_from(((r, {'label': F[r], 'type': 'oss'})
@@ -151,8 +174,9 @@ def file2graph_topfarm(filename, input_x,input_y, boundary, rotation=None):
                            'WT coordinates', 'Forbidden Zones']:
                 continue
             if key == 'Forbidden Zones':
-                if ws['A3'].value is not None:
-                    print('Forbidden Zones not yet implemented.')
+                zones = forbidden_zones_from_sheet(ws, rotation)
+                if zones:
+                    data[key] = zones
                 continue
             for cell, header in (('A2', 'x (m)'),
                                  ('B2', 'y (m)')):
@@ -218,6 +242,8 @@ def file2graph_topfarm(filename, input_x,input_y, boundary, rotation=None):
                  VertexC=np.vstack((WTcoords.T, OSScoords.T[::-1])),
                  boundary=boundary,
                  name=fpath.stem)
+    if 'Forbidden Zones' in data:
+        G.graph['exclusions'] = data['Forbidden Zones']
     G.add_nodes_from(((n, {'label': F[n], 'type': 'wtg'})
                       for n in range(N)))
     G.add_nodes_from(((r, {'label': F[r], 'type': 'oss'})
@@ -116,6 +116,25 @@ def T_from_G(G):
     return T
 
 
+def tree_edges(G):
+    '''
+    G: networkx graph with cables assigned (call assign_cables(G) first)
+
+    returns:
+    u, v: vertex indices of the edge ends in G.graph['VertexC'] (turbines >= 0,
+          roots < 0); detour clones (OBEW) are mapped to their prime vertex
+    length: edge lengths
+    cost: cost per unit length of the cable of each edge
+    '''
+    edges = np.array([(u, v, data['length'], data['cable'])
+                      for u, v, data in G.edges(data=True)], dtype=float).reshape(-1, 4)
+    u, v = edges[:, 0].astype(int), edges[:, 1].astype(int)
+    if 'fnT' in G.graph:
+        fnT = G.graph['fnT']
+        u, v = fnT[u], fnT[v]
+    cost = G.graph['cables']['cost'][edges[:, 3].astype(int)]
+    return u, v, edges[:, 2], cost
+
 
 class HeuristicFactory():
     '''
@@ -147,15 +166,32 @@ class HeuristicFactory():
                                     for r in range(-M, 0)))
         self.heuristic = heuristics[heuristic]
 
-    def calccost(self, X, Y):
+    def set_coordinates(self, X, Y):
         assert len(X) == len(Y) == self.N
         self.VertexC[:self.N, 0] = X
         self.VertexC[:self.N, 1] = Y
+
+    def calccost(self, X, Y):
+        self.set_coordinates(X, Y)
         make_graph_metrics(self.G_base)
         self.G = self.heuristic(self.G_base, capacity=self.k)
         calcload(self.G)
         assign_cables(self.G, self.cables)
-        return self.G.size(weight='cost')
+        return self.G.size(weight='weight')
+
+    def updatecost(self, X, Y):
+        '''
+        Cost of the last tree (same edges and cables) with the turbines moved to
+        X, Y: only the edge lengths and weights are updated, the heuristic is not
+        run. Must have called calccost() at least once.
+        '''
+        self.set_coordinates(X, Y)
+        u, v, _, cost = tree_edges(self.G)
+        length = np.hypot(*(self.VertexC[u] - self.VertexC[v]).T)
+        for (_, _, data), L, c in zip(self.G.edges(data=True), length, cost):
+            data['length'] = L
+            data['weight'] = L*c
+        return self.G.size(weight='weight')
 
     def get_table(self):
         '''
@@ -166,6 +202,36 @@ class HeuristicFactory():
         return T_from_G(self.G)
 
 
+class CentroidHeuristicFactory(HeuristicFactory):
+    '''
+    HeuristicFactory with a single substation at the centroid of the turbines,
+    which is the electrical layout drawn by OffshoreSystemPlot (same vertices as
+    farmrepo.g1(x, y, boundary).horns). The graph is built once; calccost() and
+    updatecost() move the turbines and the substation in place, without reading
+    any farm file.
+    Inputs:
+    N: number of turbines
+    boundaryC: 2D numpy array (_, 2) of the XY coordinates of the boundary
+    cables: [(«cross section», «capacity», «cost»), ...] in increasing capacity order
+    name: site name
+    '''
+
+    def __init__(self, N, boundaryC, heuristic, cables, name='unnamed'):
+        super().__init__(N, 1, np.zeros((1, 2)), boundaryC, heuristic, cables, name=name)
+
+    def set_coordinates(self, X, Y):
+        super().set_coordinates(X, Y)
+        self.VertexC[self.N:] = (np.mean(X), np.mean(Y))
+
+    def get_XY(self):
+        '''
+        X, Y of the vertices in the order of get_table() (and heuristic_wrapper):
+        substation first, then the turbines.
+        '''
+        X, Y = np.hstack((self.VertexC[-1:-1 - self.M:-1].T, self.VertexC[:-self.M].T))
+        return X, Y
+
+
 
 def heuristic_wrapper(X, Y, cables, M=1, heuristic='CPEW', return_graph=False):
     '''
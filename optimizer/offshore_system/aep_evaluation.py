@@ -0,0 +1,403 @@
+# External libraries
+import copy
+import multiprocessing
+import platform
+from collections import OrderedDict
+
+import numpy as np
+from autograd import value_and_grad
+from autograd.tracer import getval
+from py_wake.site.xrsite import UniformSite, UniformWeibullSite
+from py_wake.utils.gradients import AutogradNumpy
+
+
+# Peak memory per (turbine, turbine, wd, ws) flow-case pair, measured with
+# tracemalloc on PropagateDownwind/Bastankhah models (~6 B forward, ~45 B for
+# the autograd tape) and rounded up for margin.
+AEP_BYTES_PER_PAIR = 8
+GRADIENT_BYTES_PER_PAIR = 64
+
+
+def flow_case_blocks(n_turbines, wd, ws, memory_GB=None, gradients=True, min_wd_chunks=1):
+    """
+    Split the (wd, ws) flow cases into blocks whose estimated peak memory fits
+    in `memory_GB`.
+
+    Wind directions are split first. Wind speeds are only split when a single
+    direction still exceeds the budget, and each speed block keeps at least two
+    speeds so PyWake derives the same bin widths as for the full grid.
+    `min_wd_chunks` forces at least that many direction blocks (e.g. one per
+    worker process).
+
+    Returns
+    -------
+    list of (wd_block, ws_block) tuples covering all flow cases
+    """
+    wd, ws = np.atleast_1d(wd), np.atleast_1d(ws)
+    if memory_GB is None:
+        n_chunks = 1
+    else:
+        bytes_per_pair = GRADIENT_BYTES_PER_PAIR if gradients else AEP_BYTES_PER_PAIR
+        size_GB = n_turbines**2 * len(wd) * len(ws) * bytes_per_pair / 1024**3
+        n_chunks = int(np.ceil(size_GB / memory_GB))
+
+    wd_chunks = int(np.clip(max(n_chunks, min_wd_chunks), 1, len(wd)))
+    ws_chunks = int(np.clip(np.ceil(n_chunks / wd_chunks), 1, max(len(ws) // 2, 1)))
+
+    return [(wd_block, ws_block)
+            for wd_block in np.array_split(wd, wd_chunks)
+            for ws_block in np.array_split(ws, ws_chunks)]
+
+
+def _block_scale(site, wd, wd_block):
+    # PyWake normalises the sector probability by the bin size of the wd it is
+    # given, so partial blocks are rescaled to the bin size of the full rose
+    # (same as WindFarmModel._aep_chunk_wrapper)
+    return site.wd_bin_size(wd) / site.wd_bin_size(wd_block)
+
+
+def aep_and_gradients(wf_model, x, y, memory_GB=None, **kwargs):
+    """
+    AEP and its gradient wrt. the turbine coordinates from a single autograd pass.
+
+    PyWake's `aep_gradients` discards the forward value, so running it after
+    `sim_res(x, y).aep()` repeats the full wake simulation. Here the forward
+    value is kept from the same tape that produces the gradient.
+
+    With `memory_GB` set, the flow cases are evaluated in blocks sized from the
+    budget (see `flow_case_blocks`) and the AEP and gradient are accumulated, so
+    only one block's autograd tape is alive at a time.
+
+    Parameters
+    ----------
+    wf_model :          PyWake wind farm model
+    x, y (float):       wind turbine coordinates, shape (n,)
+    memory_GB (float):  peak memory budget, None evaluates all flow cases at once
+    **kwargs:           passed on to `wf_model.aep` (wd, ws, ...)
+
+    Returns
+    -------
+    aep (float):            AEP in GWh
+    daep (float, np.array): gradient of the AEP, shape (2, n) ordered as [d/dx, d/dy]
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    site = wf_model.site
+    wd, ws = site.get_defaults(kwargs.pop('wd', None), kwargs.pop('ws', None))
+
+    aep, daep = 0.0, np.zeros((2, n))
+    for wd_block, ws_block in flow_case_blocks(n, wd, ws, memory_GB):
+        aep_b, daep_b = _block_aep_and_gradients(wf_model, x, y, wd, wd_block, ws_block, **kwargs)
+        aep += aep_b
+        daep += daep_b
+
+    return aep, daep
+
+
+def _block_aep(wf_model, x, y, wd, wd_block, ws_block, **kwargs):
+    return (_block_scale(wf_model.site, wd, wd_block)
+            * wf_model.aep(x, y, wd=wd_block, ws=ws_block, **kwargs))
+
+
+def _block_aep_and_gradients(wf_model, x, y, wd, wd_block, ws_block, **kwargs):
+    n = len(x)
+
+    def aep_xy(xy):
+        return wf_model.aep(xy[:n], xy[n:], wd=wd_block, ws=ws_block, **kwargs)
+
+    with AutogradNumpy():
+        aep, daep = value_and_grad(aep_xy)(np.concatenate((x, y)))
+
+    scale = _block_scale(wf_model.site, wd, wd_block)
+    return scale*float(aep), scale*np.asarray(daep).reshape(2, n)
+
+
+def chunked_aep(wf_model, x, y, memory_GB=None, **kwargs):
+    """
+    Forward-only AEP (GWh) evaluated over flow-case blocks sized from `memory_GB`.
+    """
+    site = wf_model.site
+    wd, ws = site.get_defaults(kwargs.pop('wd', None), kwargs.pop('ws', None))
+
+    return sum(_block_aep(wf_model, x, y, wd, wd_block, ws_block, **kwargs)
+               for wd_block, ws_block in flow_case_blocks(len(x), wd, ws, memory_GB,
+                                                          gradients=False))
+
+
+def _layouts_per_batch(n_turbines, n_flow_cases, memory_GB, gradients):
+    if memory_GB is None:
+        return None
+    bytes_per_pair = GRADIENT_BYTES_PER_PAIR if gradients else AEP_BYTES_PER_PAIR
+    layout_GB = n_turbines**2 * n_flow_cases * bytes_per_pair / 1024**3
+    return int(memory_GB // layout_GB)
+
+
+def batch_aep(wf_model, layouts, gradients=False, memory_GB=None, cache=None):
+    """
+    AEP of K candidate layouts (and optionally their gradients) in one vectorized call.
+
+    PyWake accepts turbine positions that depend on the wind direction (x_il), so
+    the K layouts are stacked along a repeated wind direction axis and simulated
+    by a single wake model call. Site, turbine and local wind setup happen once per
+    batch instead of once per layout, and no SimulationResult (xarray) is built.
+    Since the layouts do not interact, the gradient of the summed AEP wrt. the
+    stacked positions is the per-layout gradient.
+
+    Parameters
+    ----------
+    wf_model :                  PyWake wind farm model
+    layouts (float, np.array):  candidate layouts, shape (K, 2, n) as [[x], [y]] per layout
+    gradients (bool):           also return the AEP gradients
+    memory_GB (float):          peak memory budget; layouts are batched to fit it, and
+                                a layout that alone exceeds it is evaluated in flow-case
+                                blocks (see `flow_case_blocks`)
+    cache :                     `DiskCache` of wf_model; cached layouts are not simulated
+                                and new results are added to it
+
+    Returns
+    -------
+    aep (float, np.array):      AEP in GWh, shape (K,)
+    daep (float, np.array):     only if gradients=True, shape (K, 2, n)
+    """
+    layouts = np.asarray(layouts, dtype=float)
+    K, _, n = layouts.shape
+    if cache is not None:
+        return _cached_batch_aep(wf_model, layouts, gradients, memory_GB, cache)
+    site = wf_model.site
+    wd, ws = site.get_defaults(None, None)
+    L = len(wd)
+
+    per_batch = _layouts_per_batch(n, L*len(ws), memory_GB, gradients) or K
+    if per_batch < 1:
+        # A single layout exceeds the budget: fall back to flow-case blocks
+        if gradients:
+            results = [aep_and_gradients(wf_model, *layout, memory_GB=memory_GB)
+                       for layout in layouts]
+            return (np.array([aep for aep, _ in results]),
+                    np.array([daep for _, daep in results]))
+        return np.array([chunked_aep(wf_model, *layout, memory_GB=memory_GB)
+                         for layout in layouts])
+
+    aep = np.empty(K)
+    daep = np.empty((K, 2, n)) if gradients else None
+    for k0 in range(0, K, per_batch):
+        batch = layouts[k0:k0 + per_batch]
+        k1 = k0 + len(batch)
+        if gradients:
+            aep[k0:k1], daep[k0:k1] = _stacked_aep_and_gradients(wf_model, batch, wd, ws)
+        else:
+            aep[k0:k1] = _stacked_aep(wf_model, batch[:, 0], batch[:, 1], wd, ws)
+
+    if gradients:
+        return aep, daep
+    return aep
+
+
+def _cached_batch_aep(wf_model, layouts, gradients, memory_GB, cache):
+    K, _, n = layouts.shape
+    item = 'daep' if gradients else 'aep'
+    entries = [cache.load(*layout) for layout in layouts]
+    todo = [k for k, entry in enumerate(entries) if entry is None or item not in entry]
+    if todo:
+        result = batch_aep(wf_model, layouts[todo], gradients=gradients, memory_GB=memory_GB)
+        aep_todo, daep_todo = result if gradients else (result, [None]*len(todo))
+        for k, aep_k, daep_k in zip(todo, aep_todo, daep_todo):
+            entries[k] = dict(aep=float(aep_k)) if daep_k is None else dict(aep=float(aep_k), daep=daep_k)
+            cache.store(*layouts[k], **entries[k])
+
+    aep = np.array([entry['aep'] for entry in entries])
+    if gradients:
+        return aep, np.array([entry['daep'] for entry in entries])
+    return aep
+
+
+def _stacked_aep(wf_model, X, Y, wd, ws):
+    # X, Y: (K, n). Layout k is active for the k-th copy of the wind rose.
+    K, L = len(X), len(wd)
+    layout_l = np.repeat(np.arange(K), L)
+    wd_stacked = np.tile(wd, K)
+    _, _, power_ilk, _, localWind, _ = wf_model(X.T[:, layout_l], Y.T[:, layout_l],
+                                                wd=wd_stacked, ws=ws,
+                                                return_simulationResult=False)
+    scale = _block_scale(wf_model.site, wd, wd_stacked)
+    energy_l = (power_ilk * localWind.P_ilk).sum(2).sum(0)
+    return scale * energy_l.reshape(K, L).sum(1) * 24 * 365 * 1e-9
+
+
+def _stacked_aep_and_gradients(wf_model, layouts, wd, ws):
+    K, _, n = layouts.shape
+    aep = {}
+
+    def total_aep(XY):
+        aep_k = _stacked_aep(wf_model, XY[:, 0], XY[:, 1], wd, ws)
+        aep['k'] = np.asarray(getval(aep_k))
+        return aep_k.sum()
+
+    with AutogradNumpy():
+        _, daep = value_and_grad(total_aep)(layouts)
+
+    return aep['k'], np.asarray(daep).reshape(K, 2, n)
+
+
+# Wind farm model held by each SectorPool worker (set once by the initializer)
+_worker_wf_model = None
+
+
+def _init_worker(wf_model):
+    global _worker_wf_model
+    _worker_wf_model = wf_model
+
+
+def _worker_block(args):
+    gradients, x, y, wd, wd_block, ws_block = args
+    if gradients:
+        return _block_aep_and_gradients(_worker_wf_model, x, y, wd, wd_block, ws_block)
+    return _block_aep(_worker_wf_model, x, y, wd, wd_block, ws_block)
+
+
+class SectorPool():
+    '''
+    Persistent process pool evaluating AEP (and gradients) over wind direction blocks.
+
+    The wind farm model (site, turbines and wake model) is shipped to each worker
+    once, when the pool starts, so a task only carries the layout and its block of
+    flow cases. Each sector's wake solution is independent, so the blocks are
+    reduced by summation.
+
+    wf_model:   PyWake wind farm model
+    n_cpu:      number of worker processes, None uses all CPUs
+    memory_GB:  per-worker peak memory budget, see `flow_case_blocks`
+    '''
+
+    def __init__(self, wf_model, n_cpu=None, memory_GB=None):
+        self.wf_model = wf_model
+        self.n_cpu = n_cpu or multiprocessing.cpu_count()
+        self.memory_GB = memory_GB
+        if platform.system() == 'Darwin':
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        self.pool = context.Pool(self.n_cpu, initializer=_init_worker, initargs=(wf_model,))
+
+    def _tasks(self, x, y, gradients):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        wd, ws = self.wf_model.site.get_defaults(None, None)
+        return [(gradients, x, y, wd, wd_block, ws_block)
+                for wd_block, ws_block in flow_case_blocks(len(x), wd, ws, self.memory_GB,
+                                                           gradients=gradients,
+                                                           min_wd_chunks=self.n_cpu)]
+
+    def aep(self, x, y):
+        return sum(self.pool.map(_worker_block, self._tasks(x, y, gradients=False)))
+
+    def aep_and_gradients(self, x, y):
+        results = self.pool.map(_worker_block, self._tasks(x, y, gradients=True))
+        return (sum(aep for aep, _ in results),
+                np.sum([daep for _, daep in results], axis=0))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+class UniformLocalWindSite():
+    '''
+    Site proxy that builds the local wind of a uniform site once per flow-case grid.
+
+    PyWake calls `site.local_wind` on every simulation, which interpolates the
+    site's xarray Dataset for all (wd, ws). For UniformSite/UniformWeibullSite the
+    result does not depend on the turbine positions, so it is kept and returned
+    again for the same number of turbines, hub heights, wd and ws. All other
+    attributes are those of the wrapped site.
+    '''
+
+    def __init__(self, site):
+        assert isinstance(site, (UniformSite, UniformWeibullSite)), \
+            'Local wind can only be reused for position-independent (uniform) sites'
+        self._site = site
+        self._local_wind = {}
+
+    def __getattr__(self, name):
+        if name == '_site':
+            raise AttributeError(name)
+        return getattr(self._site, name)
+
+    def local_wind(self, x=None, y=None, h=None, wd=None, ws=None, time=False, **kwargs):
+        if time is not False or kwargs:
+            return self._site.local_wind(x=x, y=y, h=h, wd=wd, ws=ws, time=time, **kwargs)
+        wd, ws = self._site.get_defaults(wd, ws)
+        key = (np.size(getval(x)),
+               np.asarray(getval(h), dtype=float).tobytes(),
+               np.asarray(wd, dtype=float).tobytes(),
+               np.asarray(ws, dtype=float).tobytes())
+        if key not in self._local_wind:
+            self._local_wind[key] = self._site.local_wind(x=getval(x), y=getval(y), h=getval(h),
+                                                          wd=wd, ws=ws)
+        return self._local_wind[key]
+
+
+def lean_wind_farm_model(wf_model):
+    """
+    Copy of a PyWake wind farm model for the optimization loop that creates no
+    xarray objects per evaluation.
+
+    Evaluations go through `WindFarmModel.aep`, which reduces the numpy power
+    and probability arrays of the wake model directly instead of building a
+    SimulationResult, and the site's local wind is computed once (see
+    `UniformLocalWindSite`). The original model is left untouched.
+    """
+    lean = copy.copy(wf_model)
+    lean.site = UniformLocalWindSite(wf_model.site)
+    return lean
+
+
+class LayoutCache():
+    '''
+    Small LRU cache of AEP/gradient evaluations keyed by the exact layout.
+
+    OpenMDAO drivers call `compute` and `compute_partials` at the same point,
+    and often call `compute` again at a point that was already evaluated
+    (e.g. `run_model` before `compute_totals`). Entries are dicts, so the
+    AEP and its gradient can be filled in at different times.
+
+    hits/misses count lookups of the AEP ('aep') and gradient ('daep') items.
+    '''
+
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(x, y):
+        return (np.asarray(x, dtype=float).tobytes()
+                + np.asarray(y, dtype=float).tobytes())
+
+    def get(self, x, y, item):
+        entry = self.entries.get(self.key(x, y))
+        if entry is None or item not in entry:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(self.key(x, y))
+        self.hits += 1
+        return entry[item]
+
+    def store(self, x, y, **items):
+        key = self.key(x, y)
+        self.entries.setdefault(key, {}).update(items)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    hit_rate=self.hits/lookups if lookups else 0.0,
+                    entries=len(self.entries))
@@ -0,0 +1,120 @@
+# External libraries
+import numpy as np
+import openmdao.api as om
+
+from wesl.optimizer.interarray.interface import CentroidHeuristicFactory, HeuristicFactory, tree_edges
+from wesl.optimizer.offshore_system.topology_schedule import TopologySchedule
+
+
+class InterArrayCableCost(om.ExplicitComponent):
+
+    """
+    Inter-array cable cost and length of the electrical layout found by an
+    Esau-Williams heuristic (CPEW or OBEW, see interface.HeuristicFactory).
+
+    Parameters:
+    ----------------------------------------------------------------------------------
+    Variable                      Description
+    x (float):                    wind turbine coordinates in the x axis
+    y (float):                    wind turbine coordinates in the y axis
+    n_turbines (int):             number of wind turbines
+    boundary (float):             boundary polygon vertices, shape (m, 2)
+    cables (list):                [(cross section, capacity, cost per m), ...] in increasing capacity order
+    heuristic (str):              'CPEW' or 'OBEW'
+    substation (float):           substation coordinates, shape (2,); default the turbine centroid
+    topology_refresh (dict):      TopologySchedule options (every, max_displacement, check_crossings);
+                                  default: heuristic run at every evaluation
+    cable_cost (float):           total cable cost (in the units of the cable costs)
+    cable_length (float):         total cable length [m]
+    ----------------------------------------------------------------------------------
+
+    Usage:
+    ----------------------------------------------------------------------------------
+    The heuristic runs in compute; the partials are the derivatives of the edge
+    lengths for the tree (and cable types) of that run, so the cost can enter a
+    gradient-based objective without finite-differencing the heuristic. With the
+    substation at the centroid, the edges to the substation depend on all turbines.
+    With `topology_refresh`, the tree is kept between refreshes and only its edge
+    lengths are updated (see TopologySchedule); `schedule.stats()` counts the
+    heuristic calls avoided.
+
+    prob.model.add_subsystem('Cable_Cost',
+                             InterArrayCableCost(n_turbines = 63,
+                                                 boundary = boundary),
+                             promotes_inputs=['x', 'y'])
+
+    AEP-vs-cable trade-off, with FBWF.AEP the negative AEP [GWh] and value_GWh the
+    value of one GWh per year in the units of the cable costs:
+
+    prob.model.add_subsystem('Objective',
+                             om.ExecComp('obj = AEP + cable_cost/value_GWh', value_GWh={'val': 1e6}))
+    prob.model.connect('FBWF.AEP', 'Objective.AEP')
+    prob.model.connect('Cable_Cost.cable_cost', 'Objective.cable_cost')
+    prob.model.add_objective('Objective.obj')
+    """
+
+    def initialize(self):
+        self.options.declare('n_turbines', types=int, desc='Number of turbines')
+        self.options.declare('boundary', types=np.ndarray, desc='Boundary polygon vertices, shape (m, 2)')
+        self.options.declare('cables', default=[(-1, 2, 1000), (-1, 4, 1500)], types=list,
+                             desc='(cross section, capacity, cost per m) in increasing capacity order')
+        self.options.declare('heuristic', default='CPEW', values=['CPEW', 'OBEW'],
+                             desc='Esau-Williams heuristic for the cable tree')
+        self.options.declare('substation', default=None, types=np.ndarray, allow_none=True,
+                             desc='Substation coordinates, default the turbine centroid')
+        self.options.declare('topology_refresh', default=None, types=dict, allow_none=True,
+                             desc='TopologySchedule options, default a new tree at every evaluation')
+
+    def setup(self):
+        n = self.options['n_turbines']
+        self.add_input('x', shape=n, desc='Turbine x-coordinates')
+        self.add_input('y', shape=n, desc='Turbine y-coordinates')
+        self.add_output('cable_cost', val=0.0, desc='Total inter-array cable cost')
+        self.add_output('cable_length', val=0.0, desc='Total inter-array cable length [m]')
+
+        # Scalar outputs: dense (1, n) rows, assembled from 2 nonzeros per edge
+        self.declare_partials(['cable_cost', 'cable_length'], ['x', 'y'])
+
+        substation = self.options['substation']
+        if substation is None:
+            factory = CentroidHeuristicFactory(n, self.options['boundary'], self.options['heuristic'],
+                                               self.options['cables'])
+        else:
+            factory = HeuristicFactory(n, 1, np.reshape(substation, (1, 2)), self.options['boundary'],
+                                       self.options['heuristic'], self.options['cables'])
+        refresh = self.options['topology_refresh']
+        if refresh is None:
+            refresh = dict(every=1, check_crossings=False)
+        self.schedule = TopologySchedule(factory, **refresh)
+        self.edges = None
+
+    def compute(self, inputs, outputs):
+        outputs['cable_cost'] = self.schedule.calccost(inputs['x'], inputs['y'])
+        self.edges = tree_edges(self.schedule.G)
+        outputs['cable_length'] = self.edges[2].sum()
+
+    def compute_partials(self, inputs, J):
+        n = self.options['n_turbines']
+        u, v, _, cost = self.edges
+        vertices = self.schedule.VertexC.copy()
+        vertices[:n, 0] = inputs['x']
+        vertices[:n, 1] = inputs['y']
+        if self.options['substation'] is None:
+            vertices[n:] = (inputs['x'].mean(), inputs['y'].mean())
+
+        # d(length)/d(end u) = (C_u - C_v)/length, and the opposite for end v
+        delta = vertices[u] - vertices[v]
+        length = np.maximum(np.linalg.norm(delta, axis=1), 1e-12)
+        unit = delta / length[:, None]
+
+        # Vertex indices of the roots are negative: shift them after the turbines
+        ends = np.concatenate((u, v)) % len(vertices)
+        for output, weight in (('cable_length', np.ones_like(cost)), ('cable_cost', cost)):
+            for k, wrt in enumerate(('x', 'y')):
+                contribution = np.concatenate((weight * unit[:, k], -weight * unit[:, k]))
+                grad = np.bincount(ends, weights=contribution, minlength=len(vertices))
+                d_turbines = grad[:n]
+                if self.options['substation'] is None:
+                    # Substation at the centroid moves by 1/n of each turbine move
+                    d_turbines = d_turbines + grad[n:].sum() / n
+                J[output, wrt] = d_turbines
@@ -0,0 +1,261 @@
+# External libraries
+import json
+import os
+import tempfile
+import types
+import zipfile
+from hashlib import sha256
+
+import numpy as np
+
+# Journal of the entry size changes, shared by all processes using the directory
+SIZE_JOURNAL = 'size.journal'
+
+# Attributes that change while a model is used and do not affect its results
+_VOLATILE_ATTRIBUTES = {'site', 'windTurbines', '_site', '_local_wind',
+                        'deficit_initalized', 'pair_fraction', 'n_levels', 'n_calibrations'}
+
+
+def _array_digest(a, decimals=6):
+    a = np.asarray(a)
+    if a.dtype.kind in 'biuf':
+        a = np.round(a.astype(float), decimals)
+    return sha256(a.tobytes() + str(a.shape).encode()).hexdigest()
+
+
+def _describe(obj, seen):
+    '''JSON-serializable description of a model object and its parameters'''
+    if isinstance(obj, (bool, int, float, str, type(None))):
+        return obj
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return _array_digest(obj)
+    if isinstance(obj, (list, tuple)):
+        return [_describe(o, seen) for o in obj]
+    if isinstance(obj, (set, frozenset)):
+        return sorted(str(_describe(o, seen)) for o in obj)
+    if isinstance(obj, dict):
+        return {str(k): _describe(v, seen) for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(obj, (types.FunctionType, types.MethodType, types.BuiltinFunctionType, type)):
+        return obj.__qualname__
+
+    name = type(obj).__qualname__
+    if id(obj) in seen or not hasattr(obj, '__dict__'):
+        return name
+    seen.add(id(obj))
+    return [name, {k: _describe(v, seen) for k, v in sorted(vars(obj).items())
+                   if k not in _VOLATILE_ATTRIBUTES}]
+
+
+def site_digest(site):
+    '''SHA-256 hex digest of the site's wind resource and defaults'''
+    h = sha256(type(site).__qualname__.encode())
+    for name in sorted(site.ds.variables):
+        h.update(name.encode() + _array_digest(site.ds[name].values).encode())
+    wd, ws = site.get_defaults(None, None)
+    h.update(_array_digest(wd).encode() + _array_digest(ws).encode())
+    h.update(json.dumps(_describe({k: v for k, v in vars(site).items() if k != 'ds'}, set()),
+                        default=str).encode())
+    return h.hexdigest()
+
+
+def turbine_digest(windTurbines, ws=np.arange(0, 40.5, .5)):
+    '''SHA-256 hex digest of the turbine names, dimensions and power/ct curves'''
+    h = sha256(json.dumps([str(name) for name in np.atleast_1d(windTurbines.name())]).encode())
+    h.update(_array_digest(windTurbines.diameter()).encode())
+    h.update(_array_digest(windTurbines.hub_height()).encode())
+    h.update(_array_digest(windTurbines.power(ws)).encode())
+    h.update(_array_digest(windTurbines.ct(ws)).encode())
+    return h.hexdigest()
+
+
+def model_digest(wf_model, **options):
+    """
+    SHA-256 hex digest identifying what an AEP evaluation depends on besides the
+    layout: site, wind turbines, wake model and its options (also of wrappers like
+    `CalibratedWakeModel`), and any further evaluation `options`.
+    """
+    description = dict(site=site_digest(wf_model.site),
+                       windTurbines=turbine_digest(wf_model.windTurbines),
+                       model=_describe(wf_model, set()),
+                       options=_describe(options, set()))
+    return sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class DiskCache():
+    '''
+    Persistent, content-addressed cache of AEP/gradient evaluations.
+
+    Entries are .npz files named by the SHA-256 digest of the exact layout
+    coordinates, the flow cases (if not the site defaults) and `model_digest`, so
+    they are shared by all runs and processes using the same site, turbines and
+    wake model. The coordinates are not rounded: a finite-difference or
+    complex-step perturbation is a different layout and never hits the entry of
+    the unperturbed one.
+
+    Writes go to a temporary file that is atomically renamed into place, so
+    concurrent processes never read a partial entry; a lost race only loses an
+    entry. Reading an entry refreshes its modification time. The total size is
+    tracked in an append-only journal of size changes (`SIZE_JOURNAL`), of which a
+    store only reads the records added since its last one; only when the total
+    exceeds `max_GB` is the directory scanned and the least recently used entries
+    removed, and the journal corrected to the scanned size.
+
+    Parameters
+    ----------
+    path (str):         cache directory
+    wf_model :          wind farm model the evaluations belong to
+    max_GB (float):     size cap of the cache directory
+    **options :         further settings the evaluations depend on (e.g. quadrature nodes)
+
+    Usage
+    -----
+    cache = DiskCache('aep_cache', wf_model)
+    entry = cache.load(x, y)                    # dict with 'aep' (and 'daep') or None
+    cache.store(x, y, aep=aep, daep=daep)
+    '''
+
+    def __init__(self, path, wf_model, max_GB=1., **options):
+        self.path = path
+        self.max_bytes = max_GB*1024**3
+        self.model_digest = model_digest(wf_model, **options)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+        self.journal = os.path.join(path, SIZE_JOURNAL)
+        try:
+            # First user of the directory: the journal starts with the size of what is there
+            fd = os.open(self.journal, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(f"{sum(s for _, s, _ in self._entries())}\n")
+        self.size = 0
+        self.journal_offset = 0
+        self._read_journal()
+
+    def key(self, x, y, flow_cases=None):
+        h = sha256(self.model_digest.encode())
+        for c in (x, y):
+            # Exact bytes (-0.0 -> 0.0); rounding would return the unperturbed value for FD steps
+            h.update((np.ascontiguousarray(c, dtype=float) + 0.).tobytes())
+        for name, value in sorted((flow_cases or {}).items()):
+            if value is not None:
+                h.update(name.encode() + _array_digest(value).encode())
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.npz')
+
+    def load(self, x, y, flow_cases=None):
+        '''Cached items of a layout as a dict, or None'''
+        file = self._file(self.key(x, y, flow_cases))
+        try:
+            with np.load(file) as data:
+                entry = {name: data[name] for name in data.files}
+            os.utime(file)
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        self.hits += 1
+        if 'aep' in entry:
+            entry['aep'] = float(entry['aep'])
+        return entry
+
+    def store(self, x, y, flow_cases=None, **items):
+        '''Add items (e.g. aep, daep) to the entry of a layout'''
+        file = self._file(self.key(x, y, flow_cases))
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        old_size = 0
+        try:
+            with np.load(file) as data:
+                entry = {name: data[name] for name in data.files}
+            old_size = os.path.getsize(file)
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            entry = {}
+        entry.update(items)
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(file), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **entry)
+            new_size = os.path.getsize(tmp)
+            os.replace(tmp, file)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._journal(new_size - old_size)
+        if self.size > self.max_bytes:
+            self._evict()
+
+    def _read_journal(self):
+        '''Add the size changes journaled (by any process) since the last read'''
+        try:
+            with open(self.journal, 'rb') as f:
+                f.seek(self.journal_offset)
+                records = f.read()
+        except FileNotFoundError:
+            return
+        # A record being appended by another process is read next time
+        complete = records.rfind(b'\n') + 1
+        self.size += sum(int(r) for r in records[:complete].split())
+        self.journal_offset += complete
+
+    def _journal(self, delta):
+        if delta:
+            # O_APPEND writes of one short record are not interleaved between processes
+            fd = os.open(self.journal, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            with os.fdopen(fd, 'w') as f:
+                f.write(f"{delta:+d}\n")
+        self._read_journal()
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if name.endswith('.npz'):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        size = sum(s for _, s, _ in entries)
+        if size > self.max_bytes:
+            # Least recently used first, down to 90 % of the cap
+            for _, s, file in sorted(entries):
+                try:
+                    os.remove(file)
+                except FileNotFoundError:
+                    pass
+                size -= s
+                if size <= 0.9*self.max_bytes:
+                    break
+        # Correct the journal for lost races and entries removed by hand
+        self._journal(size - self.size)
+
+    def clear(self):
+        removed = 0
+        for _, s, file in self._entries():
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                continue
+            removed += s
+        self._journal(-removed)
+
+    def stats(self):
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    hit_rate=self.hits/lookups if lookups else 0.0,
+                    entries=len(entries),
+                    size_MB=sum(s for _, s, _ in entries)/1024**2)
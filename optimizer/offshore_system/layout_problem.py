@@ -0,0 +1,155 @@
+# External libraries
+import os
+
+import numpy as np
+import openmdao.api as om
+from openmdao.utils.coloring import Coloring
+
+from wesl.optimizer.offshore_system.wind_system import FixedBottomWindFarm, OffshoreSystemPlot
+from wesl.optimizer.constraints.wind_farm_constraints import BoundaryConstraint, PairWiseSpacing
+
+
+def linear_solves(n_turbines):
+    """
+    Linear solves per total Jacobian of the layout problem, by derivative direction.
+
+    The problem has 2n design variables (x, y), one objective (AEP) and
+    n(n-1)/2 spacing plus n boundary constraints. Without coloring, fwd mode needs
+    one solve per design variable and rev mode one per response. With total
+    coloring, fwd mode cannot combine columns because the AEP row depends on all
+    turbines, while rev mode combines all constraint rows that share no turbine:
+    the spacing rows (two turbines each) need n-1 or n colors (edge coloring of
+    the complete graph) and the boundary rows (one turbine) fill the gaps, so
+    n+1 solves with the AEP row at best. OpenMDAO's greedy coloring can need more
+    (the next power of two above n for n = 16...120), still fewer than 2n.
+
+    Returns
+    -------
+    solves (dict):  'fwd' and 'rev' solves without coloring, 'fwd_colored' and
+                    'rev_colored' (lower bound) with total coloring
+    """
+    n_pairs = n_turbines * (n_turbines - 1) // 2
+    return dict(fwd=2 * n_turbines,
+                rev=1 + n_pairs + n_turbines,
+                fwd_colored=2 * n_turbines,
+                rev_colored=n_turbines + 1)
+
+
+def derivative_mode(n_turbines, total_coloring=True):
+    '''Direction ('fwd' or 'rev') with fewer linear solves per total Jacobian, see `linear_solves`'''
+    solves = linear_solves(n_turbines)
+    suffix = '_colored' if total_coloring else ''
+    return 'rev' if solves['rev' + suffix] < solves['fwd' + suffix] else 'fwd'
+
+
+def layout_problem(sim_res, x, y, boundary, min_spacing, optimizer='SLSQP', maxiter=100, tol=1e-9,
+                   total_coloring=True, mode=None, plot_options=None, scaler=0.01):
+    """
+    Prebuilt OpenMDAO layout optimization problem of the review scripts: AEP
+    (FixedBottomWindFarm) subject to pairwise spacing and boundary constraints,
+    with x and y as design variables.
+
+    The constraint components declare their sparsity (rows/cols), so their
+    partial Jacobians are already compact. Total coloring is declared on the
+    driver and the derivative direction is chosen from the problem dimensions
+    (`derivative_mode`), so a total Jacobian takes n+1 to under 2n instead of 2n
+    (fwd) or 1+n+n(n-1)/2 (rev) linear solves. The coloring is computed at the first
+    driver iteration; `coloring_report` summarizes it. OpenMDAO's warning about an
+    inefficient rev mode at setup does not account for the coloring.
+
+    Parameters
+    ----------
+    sim_res :                   PyWake wind farm model
+    x, y (float, np.array):     initial layout
+    boundary (float, np.array): boundary polygon vertices, shape (m, 2)
+    min_spacing (float):        minimum spacing [m]
+    optimizer (str):            ScipyOptimizeDriver optimizer
+    maxiter (int):              maximum number of driver iterations
+    tol (float):                driver tolerance
+    total_coloring (bool):      declare total coloring on the driver
+    mode (str):                 'fwd' or 'rev', default from `derivative_mode`
+    plot_options (dict):        OffshoreSystemPlot options; no plot component if None
+    scaler (float):             scaler of the design variables, objective and spacing
+
+    Returns
+    -------
+    prob (om.Problem):          set up problem, ready for prob.run_driver()
+
+    Usage
+    -----
+    prob = layout_problem(sim_res, x_coordinates, y_coordinates, boundary, min_spacing=5*wind_turbines.diameter())
+    prob.run_driver()
+    print(coloring_report(prob))
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_turbines = len(x)
+    if mode is None:
+        mode = derivative_mode(n_turbines, total_coloring)
+
+    prob = om.Problem()
+    prob.model.add_subsystem('FBWF',
+                             FixedBottomWindFarm(n_turbines=n_turbines,
+                                                 layout_coordinates=np.array([x, y]),
+                                                 sim_res=sim_res),
+                             promotes_inputs=['x', 'y'])
+    prob.model.add_subsystem('Spacing_Constraint',
+                             PairWiseSpacing(n_turbines=n_turbines, min_spacing=float(min_spacing)),
+                             promotes_inputs=['x', 'y'])
+    prob.model.add_subsystem('Boundary_Constraint',
+                             BoundaryConstraint(polygon_vertices=boundary, number_of_turbines=n_turbines),
+                             promotes_inputs=['x', 'y'])
+    if plot_options is not None:
+        prob.model.add_subsystem('OffshoreSystemPlot',
+                                 OffshoreSystemPlot(boundary=boundary,
+                                                    layout_coordinates=np.array([x, y]),
+                                                    **plot_options),
+                                 promotes_inputs=['x', 'y'])
+        prob.model.connect('FBWF.AEP', 'OffshoreSystemPlot.AEP')
+
+    prob.driver = om.ScipyOptimizeDriver(tol=tol)
+    prob.driver.options['optimizer'] = optimizer
+    prob.driver.options['maxiter'] = maxiter
+    prob.driver.options['disp'] = False
+    if total_coloring:
+        prob.driver.declare_coloring(show_summary=False)
+
+    prob.model.set_input_defaults('x', x)
+    prob.model.set_input_defaults('y', y)
+
+    prob.model.add_design_var('x', lower=min(boundary[:, 0]), upper=max(boundary[:, 0]), scaler=scaler)
+    prob.model.add_design_var('y', lower=min(boundary[:, 1]), upper=max(boundary[:, 1]), scaler=scaler)
+    prob.model.add_objective('FBWF.AEP', scaler=scaler)
+    prob.model.add_constraint('Spacing_Constraint.spacing_violation', lower=0.0, scaler=scaler)
+    prob.model.add_constraint('Boundary_Constraint.boundary_cons', upper=0.0)
+
+    prob.setup(mode=mode)
+    return prob
+
+
+def coloring_report(prob):
+    """
+    Linear solves per driver iteration (one total Jacobian) of a problem from
+    `layout_problem`, without and with the total coloring computed by the driver.
+
+    Returns
+    -------
+    report (dict):  mode, design variable and response sizes, uncolored solves in
+                    the chosen mode and, once the driver has run, the colored solves
+    """
+    prob.final_setup()
+    n_desvars = sum(meta['size'] for meta in prob.model.get_design_vars().values())
+    n_responses = sum(meta['size'] for meta in prob.model.get_responses().values())
+    mode = prob.model._mode
+    report = dict(mode=mode,
+                  n_desvars=int(n_desvars),
+                  n_responses=int(n_responses),
+                  uncolored_solves=int(n_desvars if mode == 'fwd' else n_responses),
+                  colored_solves=None)
+
+    # The coloring file is only current once the driver has run
+    fname = prob.driver.get_coloring_fname()
+    if prob.driver.iter_count > 0 and os.path.exists(fname):
+        coloring = Coloring.load(fname)
+        report['colored_solves'] = int(coloring.total_solves())
+    return report
@@ -0,0 +1,382 @@
+"""
+Live view of a layout optimization, split into a publisher on the driver side
+and a viewer in a separate process.
+
+The publisher writes compact iteration snapshots (layout, AEP and the cable
+segments of an InterArrayCableCost component, if any) into a memory-mapped ring buffer file, which takes microseconds and never waits
+for a reader. The viewer maps the same file and draws the newest snapshot at its
+own frame rate; snapshots written between two frames are skipped. Without a
+cable cost component, the viewer runs the cable heuristic itself, so the driver
+never waits for it. The viewer can be started, stopped or be slow at any time
+without affecting the optimization.
+
+Run the viewer with: python live_view.py <ring file> [--fps 5]
+"""
+# External libraries
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import openmdao.api as om
+
+from wesl.optimizer.interarray.interface import CentroidHeuristicFactory, tree_edges
+from wesl.optimizer.offshore_system.topology_schedule import TopologySchedule
+
+_MAGIC = b'WESLRING'
+_HEADER = np.dtype([('magic', 'S8'), ('n_turbines', '<i8'), ('max_edges', '<i8'),
+                    ('n_slots', '<i8'), ('head', '<i8')])
+
+
+def _slot_dtype(n_turbines, max_edges):
+    return np.dtype([('seq', '<i8'), ('iteration', '<i8'), ('time', '<f8'),
+                     ('aep', '<f8'), ('cable_cost', '<f8'), ('n_edges', '<i8'),
+                     ('x', '<f8', n_turbines), ('y', '<f8', n_turbines),
+                     ('segments', '<f4', (max_edges, 4)), ('cable', '<i1', max_edges)])
+
+
+def static_file(path):
+    '''Sidecar file with the data that does not change during the run (boundary, bathymetry, ...)'''
+    return path + '.static.npz'
+
+
+class SnapshotRing():
+    '''
+    Fixed-size ring buffer of layout snapshots in a memory-mapped file.
+
+    A snapshot goes to slot seq % n_slots: its sequence number is cleared while
+    the slot is written and set afterwards, and the header points to the newest
+    snapshot. A reader compares the sequence number before and after copying a
+    slot, so a snapshot overwritten during the copy is discarded instead of drawn
+    half-updated. Writes never block and never flush to disk explicitly.
+
+    Parameters
+    ----------
+    path (str):         ring buffer file
+    n_turbines (int):   number of turbines, None to open an existing file for reading
+    max_edges (int):    maximum number of cable segments per snapshot
+    n_slots (int):      number of snapshots kept
+
+    Usage
+    -----
+    ring = SnapshotRing('live.ring', n_turbines=63)      # driver side
+    ring.push(iteration, x, y, aep)
+    ring = SnapshotRing('live.ring')                     # viewer side
+    snapshot = ring.latest()                             # newest unseen snapshot or None
+    '''
+
+    def __init__(self, path, n_turbines=None, max_edges=None, n_slots=16):
+        self.path = path
+        if n_turbines is not None:
+            max_edges = 2 * n_turbines if max_edges is None else max_edges
+            slot = _slot_dtype(n_turbines, max_edges)
+            header = np.zeros(1, dtype=_HEADER)
+            header[0] = (_MAGIC, n_turbines, max_edges, n_slots, 0)
+            slots = np.zeros(n_slots, dtype=slot)
+            # Write the whole file first, then rename it into place for readers
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header.tobytes())
+                f.write(slots.tobytes())
+            os.replace(tmp, path)
+            mode = 'r+'
+        else:
+            mode = 'r'
+
+        self.header = np.memmap(path, dtype=_HEADER, mode=mode, shape=(1,))
+        if self.header['magic'][0] != _MAGIC:
+            raise ValueError(f'{path} is not a snapshot ring buffer')
+        self.n_turbines, self.max_edges, self.n_slots = (int(self.header[k][0]) for k in
+                                                         ('n_turbines', 'max_edges', 'n_slots'))
+        self.slots = np.memmap(path, dtype=_slot_dtype(self.n_turbines, self.max_edges), mode=mode,
+                               offset=_HEADER.itemsize, shape=(self.n_slots,))
+        self.last_seen = 0
+
+    @property
+    def head(self):
+        return int(self.header['head'][0])
+
+    def push(self, iteration, x, y, aep, segments=None, cable=None, cable_cost=np.nan):
+        '''
+        Write a snapshot.
+
+        Parameters
+        ----------
+        iteration (int):            driver iteration
+        x, y (float, np.array):     turbine coordinates
+        aep (float):                AEP (as given to the driver)
+        segments (float, np.array): cable segments (x1, y1, x2, y2), shape (n_edges, 4)
+        cable (int, np.array):      cable type of each segment
+        cable_cost (float):         total cable cost
+        '''
+        seq = self.head + 1
+        slot = self.slots[seq % self.n_slots]
+        slot['seq'] = 0
+        slot['iteration'] = iteration
+        slot['time'] = time.time()
+        slot['aep'] = aep
+        slot['cable_cost'] = cable_cost
+        slot['x'] = x
+        slot['y'] = y
+        n_edges = 0
+        if segments is not None:
+            n_edges = min(len(segments), self.max_edges)
+            slot['segments'][:n_edges] = segments[:n_edges]
+            slot['cable'][:n_edges] = 0 if cable is None else cable[:n_edges]
+        slot['n_edges'] = n_edges
+        slot['seq'] = seq
+        self.header['head'] = seq
+
+    def latest(self):
+        '''Newest snapshot not returned before (a copy of the slot), or None'''
+        head = self.head
+        if head <= self.last_seen:
+            return None
+        snapshot = self.slots[head % self.n_slots].copy()
+        if snapshot['seq'] != head or self.slots[head % self.n_slots]['seq'] != head:
+            # Overwritten while copying: the next call gets a newer one
+            return None
+        self.last_seen = head
+        return snapshot
+
+
+class LiveLayoutPublisher(om.ExplicitComponent):
+
+    """
+    Driver-side half of the live view: pushes a snapshot of every evaluation into
+    a SnapshotRing file for a viewer process (`run_viewer`).
+
+    Parameters:
+    ----------------------------------------------------------------------------------
+    Variable                      Description
+    x (float):                    wind turbine coordinates in the x axis
+    y (float):                    wind turbine coordinates in the y axis
+    AEP (float):                  AEP as given to the driver (FBWF.AEP)
+    n_turbines (int):             number of wind turbines
+    path (str):                   ring buffer file
+    n_slots (int):                snapshots kept in the ring buffer
+    boundary (float):             boundary polygon vertices, shape (m, 2), for the viewer
+    aep_init (float):             AEP of the initial layout, same sign as the AEP input, for the
+                                  viewer's AEP improvement
+    bathymetry (tuple):           (lon_grid, lat_grid, elevation) drawn as background by the viewer
+    spacing_diameter (float):     diameter of the spacing circles drawn by the viewer [m]
+    cable_cost (object):          InterArrayCableCost component of the model whose cable tree
+                                  is published; add the publisher after it, or the tree is
+                                  one evaluation behind
+    cables (list):                cable types [(cross section, capacity, cost), ...] for the
+                                  viewer to build the cable layout itself (CPEW, substation at
+                                  the centroid) when there is no `cable_cost`; requires `boundary`
+    start_viewer (bool):          start a viewer process at setup
+    fps (float):                  frame rate of that viewer
+    ----------------------------------------------------------------------------------
+
+    Usage:
+    ----------------------------------------------------------------------------------
+    Replaces OffshoreSystemPlot in headless or long runs; the viewer can also be
+    started later, from another shell: python live_view.py live.ring
+
+    prob.model.add_subsystem('Live_View',
+                             LiveLayoutPublisher(n_turbines = 63,
+                                                 path = 'live.ring',
+                                                 boundary = boundary,
+                                                 cables = [(-1, 2, 1000), (-1, 4, 1500)],
+                                                 start_viewer = True),
+                             promotes_inputs=['x', 'y'])
+    prob.model.connect('FBWF.AEP', 'Live_View.AEP')
+
+    With a cable cost component, its tree is published instead:
+
+    cable_cost = prob.model.add_subsystem('Cable_Cost', InterArrayCableCost(n_turbines = 63,
+                                                                            boundary = boundary),
+                                          promotes_inputs=['x', 'y'])
+    prob.model.add_subsystem('Live_View', LiveLayoutPublisher(n_turbines = 63, cable_cost = cable_cost),
+                             promotes_inputs=['x', 'y'])
+
+    prob.cleanup() stops a viewer started by the publisher.
+    """
+
+    def initialize(self):
+        self.options.declare('n_turbines', types=int, desc='Number of turbines')
+        self.options.declare('path', default='live_view.ring', types=str, desc='Ring buffer file')
+        self.options.declare('n_slots', default=16, types=int, desc='Snapshots kept in the ring buffer')
+        self.options.declare('boundary', default=None, types=np.ndarray, allow_none=True,
+                             desc='Boundary polygon vertices, shape (m, 2)')
+        self.options.declare('aep_init', default=None, allow_none=True,
+                             desc='AEP of the initial layout')
+        self.options.declare('bathymetry', default=None, types=tuple, allow_none=True,
+                             desc='(lon_grid, lat_grid, elevation) background')
+        self.options.declare('spacing_diameter', default=None, types=(float, int), allow_none=True,
+                             desc='Diameter of the spacing circles [m]')
+        self.options.declare('cable_cost', default=None, allow_none=True,
+                             desc='InterArrayCableCost component whose cable tree is published')
+        self.options.declare('cables', default=None, types=list, allow_none=True,
+                             desc='Cable types for the viewer to build the cable layout, None for no cables')
+        self.options.declare('start_viewer', default=False, types=bool, desc='Start a viewer process')
+        self.options.declare('fps', default=5., types=(float, int), desc='Frame rate of the viewer')
+
+    def setup(self):
+        n = self.options['n_turbines']
+        self.add_input('x', np.zeros(n))
+        self.add_input('y', np.zeros(n))
+        self.add_input('AEP', val=0.0)
+        if (self.options['cables'] is not None and self.options['cable_cost'] is None and
+                self.options['boundary'] is None):
+            raise ValueError(f"{self.msginfo}: the viewer builds the cable layout within the boundary, "
+                             "so cables require a boundary")
+
+        path = self.options['path']
+        self.ring = SnapshotRing(path, n_turbines=n, n_slots=self.options['n_slots'])
+        self.iteration = 0
+
+        static = dict(boundary=self.options['boundary'],
+                      aep_init=self.options['aep_init'],
+                      spacing_diameter=self.options['spacing_diameter'],
+                      cables=self.options['cables'] if self.options['cable_cost'] is None else None)
+        if self.options['bathymetry'] is not None:
+            static.update(zip(('lon_grid', 'lat_grid', 'elevation'), self.options['bathymetry']))
+        static = {k: np.asarray(v, dtype=float) for k, v in static.items() if v is not None}
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **static)
+        os.replace(tmp, static_file(path))
+
+        self.viewer = None
+        if self.options['start_viewer']:
+            self.viewer = start_viewer(path, fps=self.options['fps'])
+
+    def compute(self, inputs, outputs):
+        x, y = inputs['x'], inputs['y']
+        segments = cable = None
+        cable_cost = np.nan
+        component = self.options['cable_cost']
+        if component is not None and component.edges is not None:
+            # The tree of the component's last evaluation, no heuristic run here
+            u, v, length, cost = component.edges
+            VertexC = component.schedule.VertexC
+            segments = np.hstack((VertexC[u], VertexC[v]))
+            cable = np.array([data['cable'] for _, _, data in component.schedule.G.edges(data=True)])
+            cable_cost = (length*cost).sum()
+        self.ring.push(self.iteration, x, y, inputs['AEP'].item(), segments, cable, cable_cost)
+        self.iteration += 1
+
+    def cleanup(self):
+        if self.viewer is not None:
+            self.viewer.terminate()
+            try:
+                self.viewer.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.viewer.kill()
+                self.viewer.wait()
+            self.viewer = None
+        super().cleanup()
+
+
+def start_viewer(path, fps=5.):
+    '''Start `run_viewer` on a ring buffer file in a separate process; returns the Popen'''
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), path, '--fps', str(fps)])
+
+
+def run_viewer(path, fps=5., timeout=60.):
+    """
+    Draw the newest snapshot of a ring buffer file at `fps` frames per second,
+    until the window is closed.
+
+    Parameters
+    ----------
+    path (str):         ring buffer file written by LiveLayoutPublisher
+    fps (float):        frame rate
+    timeout (float):    time to wait for the file to appear [s]
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import EllipseCollection, LineCollection
+
+    t0 = time.time()
+    while not (os.path.exists(path) and os.path.exists(static_file(path))):
+        if time.time() - t0 > timeout:
+            raise FileNotFoundError(path)
+        time.sleep(0.2)
+    ring = SnapshotRing(path)
+    with np.load(static_file(path)) as data:
+        static = {name: data[name] for name in data.files}
+
+    fig, ax = plt.subplots()
+    if 'elevation' in static:
+        mesh = ax.pcolormesh(static['lon_grid'], static['lat_grid'], static['elevation'],
+                             cmap='Blues_r', shading='auto', vmin=-50, vmax=-20)
+        fig.colorbar(mesh, label='Water Depth (m)')
+    if 'boundary' in static:
+        boundary = static['boundary']
+        ax.plot(*np.vstack((boundary, boundary[:1])).T, label='Boundary', c='black', linestyle='--')
+        ax.set_xlim(boundary[:, 0].min(), boundary[:, 0].max())
+        ax.set_ylim(boundary[:, 1].min(), boundary[:, 1].max())
+        ax.margins(0.05)
+    ax.set_aspect('equal')
+    ax.set_xlabel('X [m]')
+    ax.set_ylabel('Y [m]')
+
+    initial = None
+    circles = None
+    if 'spacing_diameter' in static:
+        d = float(static['spacing_diameter'])
+        circles = EllipseCollection(d, d, 0., units='xy', offsets=np.empty((0, 2)), offset_transform=ax.transData,
+                                    facecolors='none', edgecolors='gray', linestyles='--', linewidths=1)
+        ax.add_collection(circles)
+    schedule = None
+    if 'cables' in static:
+        # The cable layout is built here, at the viewer's pace, not by the driver
+        factory = CentroidHeuristicFactory(ring.n_turbines, static['boundary'], 'CPEW',
+                                           [tuple(c) for c in static['cables'].tolist()])
+        schedule = TopologySchedule(factory, every=1, check_crossings=False)
+    cable_colors = ['y', '#b87333', 'r', 'm']
+    cables = LineCollection([], linewidths=1.2)
+    ax.add_collection(cables)
+    turbines = ax.scatter([], [], marker='2', c='black', label='Current Design')
+    substation = ax.scatter([], [], c='red', label='Substation')
+    text_box = ax.text(0.01, 0.99, 'Waiting for the optimization...', transform=ax.transAxes,
+                       verticalalignment='top', fontsize=10,
+                       bbox=dict(boxstyle='round', facecolor='white', alpha=0.7))
+
+    while plt.fignum_exists(fig.number):
+        snapshot = ring.latest()
+        if snapshot is not None:
+            xy = np.column_stack((snapshot['x'], snapshot['y']))
+            if initial is None:
+                initial = ax.scatter(*xy.T, c='orange', marker='.', s=8, label='Initial Layout')
+                ax.legend(loc='upper center', bbox_to_anchor=(0.5, 1.15), ncol=2, fontsize=10)
+            turbines.set_offsets(xy)
+            substation.set_offsets(xy.mean(0, keepdims=True))
+            if circles is not None:
+                circles.set_offsets(xy)
+            n_edges = int(snapshot['n_edges'])
+            segments = snapshot['segments'][:n_edges]
+            cable = snapshot['cable'][:n_edges]
+            cable_cost = snapshot['cable_cost']
+            if schedule is not None:
+                cable_cost = schedule.calccost(snapshot['x'], snapshot['y'])
+                u, v, _, _ = tree_edges(schedule.G)
+                segments = np.hstack((schedule.VertexC[u], schedule.VertexC[v]))
+                cable = [data['cable'] for _, _, data in schedule.G.edges(data=True)]
+            cables.set_segments(segments.reshape(-1, 2, 2))
+            cables.set_colors([cable_colors[c % len(cable_colors)] for c in cable])
+
+            text = f"Iteration: {snapshot['iteration']}"
+            if 'aep_init' in static:
+                aep_init = float(static['aep_init'])
+                text += f"\nAEP Improvement: {(snapshot['aep'] / aep_init - 1) * 100:.3f} %"
+            if np.isfinite(cable_cost):
+                text += f"\nCable cost: {cable_cost * 1e-6:.3f} M"
+            lag = time.time() - snapshot['time']
+            text_box.set_text(text + f"\n(lag {lag:.1f} s, {ring.head - snapshot['seq']} newer skipped)")
+            fig.canvas.draw_idle()
+        plt.pause(1. / fps)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Live view of a layout optimization')
+    parser.add_argument('path', help='ring buffer file written by LiveLayoutPublisher')
+    parser.add_argument('--fps', type=float, default=5., help='frame rate')
+    args = parser.parse_args()
+    run_viewer(args.path, fps=args.fps)
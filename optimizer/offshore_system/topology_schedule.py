@@ -0,0 +1,108 @@
+# External libraries
+import contextlib
+import io
+
+import numpy as np
+
+from wesl.optimizer.interarray.geometric import check_crossings
+
+
+class TopologySchedule():
+    '''
+    Refresh policy for the cable tree of a HeuristicFactory in optimization loops.
+
+    Small turbine moves rarely change the best tree, so between refreshes the
+    last tree is kept and only its edge lengths are updated
+    (`HeuristicFactory.updatecost`). The heuristic is run again when
+        - `every` evaluations have passed since the last run,
+        - a turbine has travelled more than `max_displacement` since the last run
+          (path length, summed over the evaluations), or
+        - the frozen tree crosses itself at the new coordinates
+          (`geometric.check_crossings`), if `check_crossings` is set.
+    It has the calccost/get_table interface of the factory, and the other
+    factory attributes (G, VertexC, ...) are passed through.
+
+    Parameters
+    ----------
+    factory :                   HeuristicFactory (or CentroidHeuristicFactory)
+    every (int):                evaluations between refreshes, None for no periodic refresh
+    max_displacement (float):   turbine travel that triggers a refresh [m], None for no limit
+    check_crossings (bool):     refresh when the frozen tree crosses itself
+
+    Usage
+    -----
+    schedule = TopologySchedule(CentroidHeuristicFactory(n, boundary, 'CPEW', cables),
+                                every=10, max_displacement=500.)
+    cost = schedule.calccost(x, y)
+    schedule.stats()    # evaluations, heuristic calls, avoided calls, refreshes by reason
+    '''
+
+    def __init__(self, factory, every=10, max_displacement=None, check_crossings=True):
+        self.factory = factory
+        self.every = every
+        self.max_displacement = max_displacement
+        self.check_crossings = check_crossings
+        self.reset()
+
+    def __getattr__(self, name):
+        # G, VertexC, get_XY, ... of the factory
+        if name == 'factory':
+            raise AttributeError(name)
+        return getattr(self.factory, name)
+
+    def reset(self):
+        self.n_evaluations = 0
+        self.n_heuristic_calls = 0
+        self.n_avoided = 0
+        self.refreshes = dict(initial=0, every=0, displacement=0, crossings=0)
+        self._last = None
+        self._travelled = None
+        self._since_refresh = 0
+
+    def _reason(self, X, Y):
+        '''Why the heuristic must run at X, Y before looking at crossings, or None'''
+        if self._last is None:
+            return 'initial'
+        if self.every is not None and self._since_refresh >= self.every:
+            return 'every'
+        if self.max_displacement is not None:
+            step = np.hypot(X - self._last[0], Y - self._last[1])
+            if (self._travelled + step).max() > self.max_displacement:
+                return 'displacement'
+        return None
+
+    def _crossing(self):
+        # check_crossings reports every crossing on stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            return len(check_crossings(self.factory.G)) > 0
+
+    def calccost(self, X, Y):
+        X = np.array(X, dtype=float)
+        Y = np.array(Y, dtype=float)
+        self.n_evaluations += 1
+        reason = self._reason(X, Y)
+
+        if reason is None:
+            cost = self.factory.updatecost(X, Y)
+            if self.check_crossings and self._crossing():
+                reason = 'crossings'
+            else:
+                self._travelled += np.hypot(X - self._last[0], Y - self._last[1])
+                self._last = (X, Y)
+                self._since_refresh += 1
+                self.n_avoided += 1
+                return cost
+
+        cost = self.factory.calccost(X, Y)
+        self.n_heuristic_calls += 1
+        self.refreshes[reason] += 1
+        self._travelled = np.zeros(len(X))
+        self._last = (X, Y)
+        self._since_refresh = 1
+        return cost
+
+    def stats(self):
+        return dict(evaluations=self.n_evaluations,
+                    heuristic_calls=self.n_heuristic_calls,
+                    avoided=self.n_avoided,
+                    refreshes=dict(self.refreshes))
@@ -0,0 +1,202 @@
+# External libraries
+from functools import reduce
+
+import numpy as np
+from py_wake import np as wnp  # numpy, or autograd.numpy inside AutogradNumpy
+
+from wesl.optimizer.offshore_system.aep_evaluation import aep_and_gradients
+from wesl.optimizer.windFarms_windTurbines import noj_WF_model, blondelSuperGaussian_WF_model
+
+
+def _build_wf_model(factory, site, windTurbines):
+    # Some factories also return the model name
+    wf_model = factory(site, windTurbines)
+    if isinstance(wf_model, tuple):
+        wf_model = wf_model[0]
+    return wf_model
+
+
+class CalibratedWakeModel():
+    '''
+    Cheap wind farm model corrected towards an expensive one.
+
+    `calibrate(x, y)` evaluates both models and their gradients at a layout x0 and
+    sets a first-order correction that makes the cheap model reproduce the
+    expensive AEP and its gradient at that point:
+
+        multiplicative:   AEP = AEP_cheap(x) * (b0 + db0.(x - x0)),  b0 = AEP_expensive(x0)/AEP_cheap(x0)
+        additive:         AEP = AEP_cheap(x) + (a0 + da0.(x - x0)),  a0 = AEP_expensive(x0) - AEP_cheap(x0)
+
+    with db0 and da0 chosen so that the gradients match at x0. A constant factor
+    or offset would leave the optimum and the search directions of the cheap model
+    unchanged; the first-order terms tilt the cheap model towards the expensive
+    one, so it has to be recalibrated as the layout moves (`WakeModelCascade` does
+    it every `refit_every` driver iterations). The additive correction is shared
+    out over the wind directions evaluated, so it adds up correctly over the wind
+    direction blocks of `aep_evaluation`.
+
+    Like the PyWake models it exposes `aep(x, y, wd=None, ws=None)` (autograd
+    differentiable), so it can be given to FixedBottomWindFarm.
+
+    Parameters
+    ----------
+    cheap :             PyWake wind farm model used in the optimization loop
+    expensive :         PyWake wind farm model it is calibrated against
+    correction (str):   'multiplicative' or 'additive'
+    '''
+
+    def __init__(self, cheap, expensive, correction='multiplicative'):
+        assert correction in ('multiplicative', 'additive'), \
+            "correction must be 'multiplicative' or 'additive'"
+        self.cheap = cheap
+        self.expensive = expensive
+        self.correction = correction
+        self.site = cheap.site
+        self.windTurbines = cheap.windTurbines
+        self.x0 = self.y0 = None
+        self.factor = 1.
+        self.offset = 0.
+        self.d_factor = None
+        self.d_offset = None
+        self.n_calibrations = 0
+
+    def calibrate(self, x, y):
+        '''Set the correction at layout (x, y); returns (AEP_cheap, AEP_expensive) [GWh]'''
+        aep_cheap, daep_cheap = aep_and_gradients(self.cheap, x, y)
+        aep_expensive, daep_expensive = aep_and_gradients(self.expensive, x, y)
+        self.x0, self.y0 = np.array(x, dtype=float), np.array(y, dtype=float)
+        if self.correction == 'multiplicative':
+            self.factor = aep_expensive/aep_cheap
+            self.d_factor = (daep_expensive - self.factor*daep_cheap)/aep_cheap
+        else:
+            self.offset = aep_expensive - aep_cheap
+            self.d_offset = daep_expensive - daep_cheap
+        self.n_calibrations += 1
+        return aep_cheap, aep_expensive
+
+    def aep(self, x, y, wd=None, ws=None, **kwargs):
+        '''Corrected AEP [GWh]'''
+        aep = self.cheap.aep(x, y, wd=wd, ws=ws, **kwargs)
+        if self.x0 is None:
+            return aep
+        if self.correction == 'multiplicative':
+            factor = (self.factor + wnp.sum(self.d_factor[0]*(x - self.x0))
+                      + wnp.sum(self.d_factor[1]*(y - self.y0)))
+            return factor*aep
+        offset = (self.offset + wnp.sum(self.d_offset[0]*(x - self.x0))
+                  + wnp.sum(self.d_offset[1]*(y - self.y0)))
+        wd, _ = self.site.get_defaults(wd, ws)
+        return aep + offset*len(wd)*self.site.wd_bin_size(wd)/360
+
+
+class WakeModelCascade():
+    '''
+    Multi-fidelity layout optimization over a sequence of wake models.
+
+    The factories of `windFarms_windTurbines` build the models, ordered from cheap
+    to expensive. Every phase but the last runs the driver with a cheap model
+    calibrated to first order against the last (expensive) model (see
+    `CalibratedWakeModel`). The calibration only holds near the layout it was made
+    at, so a cheap phase runs the driver in segments of `refit_every` iterations
+    and recalibrates at the layout each segment ends on; the phase ends when the
+    driver converges within a segment, the layout stops moving or the driver's
+    maxiter is used up. The final phase runs the driver with the expensive model
+    itself, starting from the layout of the previous phase. The expensive model
+    is thus only evaluated (with its gradient) once per calibration and during
+    the final phase.
+
+    Parameters
+    ----------
+    site :                  PyWake site
+    windTurbines :          PyWake wind turbines
+    factories (list):       wind farm model factories, cheap to expensive
+    correction (str):       'multiplicative' or 'additive' calibration
+    refit_every (int):      driver iterations between recalibrations of a cheap phase
+
+    Usage
+    -----
+    cascade = WakeModelCascade(site, wind_turbines, factories=[noj_WF_model, blondelSuperGaussian_WF_model])
+    prob.model.add_subsystem('FBWF', FixedBottomWindFarm(..., sim_res=cascade.models[-1]), ...)
+    prob.setup()
+    cascade.run(prob, wind_farm='FBWF')
+    cascade.history         # per phase: model, calibrations, driver iterations, evaluations
+    '''
+
+    def __init__(self, site, windTurbines, factories=(noj_WF_model, blondelSuperGaussian_WF_model),
+                 correction='multiplicative', refit_every=5):
+        assert len(factories) >= 2, 'A cascade needs at least a cheap and an expensive model'
+        self.names = [factory.__name__ for factory in factories]
+        self.models = [_build_wf_model(factory, site, windTurbines) for factory in factories]
+        self.correction = correction
+        self.refit_every = refit_every
+        self.history = []
+
+    def run(self, prob, wind_farm='FBWF'):
+        '''
+        Run all phases with `prob.driver`.
+
+        Parameters
+        ----------
+        prob :              set up OpenMDAO problem
+        wind_farm (str):    path of the FixedBottomWindFarm component in prob.model
+        '''
+        component = reduce(getattr, wind_farm.split('.'), prob.model)
+        self.history = []
+        for phase, (name, wf_model) in enumerate(zip(self.names, self.models)):
+            record = dict(phase=phase, model=name)
+            misses = component.cache_stats()['misses']
+            if phase < len(self.models) - 1:
+                wf_model = CalibratedWakeModel(wf_model, self.models[-1], correction=self.correction)
+                result = self._run_calibrated(prob, component, wind_farm, wf_model, record)
+            else:
+                component.set_wind_farm_model(wf_model)
+                result = prob.run_driver()
+                record['driver_iterations'] = _driver_iterations(prob.driver)
+            record['evaluations'] = component.cache_stats()['misses'] - misses
+            # run_driver returns a DriverResult in recent OpenMDAO, a failed flag before
+            record['success'] = result.success if hasattr(result, 'success') else not result
+            self.history.append(record)
+        return self.history
+
+    def _run_calibrated(self, prob, component, wind_farm, wf_model, record):
+        # ScipyOptimizeDriver copies maxiter into opt_settings at its first run, where it overrides the option
+        opt_settings = getattr(prob.driver, 'opt_settings', {})
+        user_maxiter = opt_settings.get('maxiter')
+        maxiter = prob.driver.options['maxiter'] if user_maxiter is None else user_maxiter
+        record['calibrations'] = []
+        record['driver_iterations'] = 0
+        try:
+            result = None
+            while record['driver_iterations'] < maxiter:
+                x = np.array(prob.get_val(f'{wind_farm}.x'))
+                y = np.array(prob.get_val(f'{wind_farm}.y'))
+                aep_cheap, aep_expensive = wf_model.calibrate(x, y)
+                record['calibrations'].append(dict(aep_cheap=aep_cheap, aep_expensive=aep_expensive,
+                                                   factor=wf_model.factor, offset=wf_model.offset))
+
+                # New correction: drop the values cached with the previous one
+                component.set_wind_farm_model(wf_model)
+                segment = min(self.refit_every, maxiter - record['driver_iterations'])
+                prob.driver.options['maxiter'] = segment
+                opt_settings.pop('maxiter', None)
+                result = prob.run_driver()
+                iterations = _driver_iterations(prob.driver)
+                record['driver_iterations'] += iterations
+
+                moved = max(np.abs(prob.get_val(f'{wind_farm}.x') - x).max(),
+                            np.abs(prob.get_val(f'{wind_farm}.y') - y).max())
+                converged = (result.success if hasattr(result, 'success') else not result) and iterations < segment
+                if converged or moved < 1e-6:
+                    break
+        finally:
+            prob.driver.options['maxiter'] = maxiter
+            opt_settings.pop('maxiter', None)
+            if user_maxiter is not None:
+                opt_settings['maxiter'] = user_maxiter
+        return result
+
+
+def _driver_iterations(driver):
+    # Optimizer iterations of a ScipyOptimizeDriver run (scipy result), else the model evaluations
+    result = getattr(driver, '_scipy_optimize_result', None)
+    return getattr(result, 'nit', None) or driver.iter_count
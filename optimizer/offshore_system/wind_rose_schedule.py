@@ -0,0 +1,139 @@
+# External libraries
+import numpy as np
+
+
+def _divisor_step(step, steps):
+    '''Closest of `steps` to `step` (log distance)'''
+    steps = np.asarray(steps)
+    return steps[np.argmin(np.abs(np.log(steps/step)))]
+
+
+def wind_rose_levels(site, n_levels=3, n_ws_coarse=5):
+    """
+    Wind rose resolutions from coarse to the site's default one.
+
+    The coarsest level uses the site's native sectors (e.g. the 12 sectors of a
+    UniformWeibullSite) and `n_ws_coarse` wind speeds. The intermediate levels
+    refine the direction step (divisors of 360 deg) and the number of wind speeds
+    geometrically, and the last level is the site's default wind directions and
+    speeds (wd=ws=None).
+
+    Parameters
+    ----------
+    site :                  PyWake site
+    n_levels (int):         number of levels, including the full resolution one
+    n_ws_coarse (int):      wind speeds of the coarsest level
+
+    Returns
+    -------
+    levels (list of dict):  wd and ws for each level
+    """
+    wd_full, ws_full = site.get_defaults(None, None)
+    wd_step_full = 360/len(wd_full)
+
+    wd_native = np.atleast_1d(site.ds.wd.values) if 'wd' in site.ds.coords else []
+    wd_native = np.unique(np.asarray(wd_native, dtype=float) % 360)
+    wd_step_coarse = 360/len(wd_native) if len(wd_native) > 1 else 30.
+    wd_steps = [s for s in range(1, 361) if 360 % s == 0 and s >= wd_step_full]
+
+    levels = []
+    for i in range(n_levels - 1):
+        frac = i/(n_levels - 1)
+        if i == 0 and len(wd_native) > 1:
+            wd = wd_native
+        else:
+            wd_step = _divisor_step(wd_step_coarse*(wd_step_full/wd_step_coarse)**frac, wd_steps)
+            wd = np.arange(0, 360, wd_step, dtype=float)
+        n_ws = int(np.round(n_ws_coarse*(len(ws_full)/n_ws_coarse)**frac))
+        ws = np.linspace(ws_full[0], ws_full[-1], max(min(n_ws, len(ws_full)), 2))
+        levels.append(dict(wd=wd, ws=ws))
+    levels.append(dict(wd=None, ws=None))
+    return levels
+
+
+class WindRoseSchedule():
+    '''
+    Multi-fidelity wind rose for layout optimization.
+
+    The AEP is evaluated on a coarse wind rose while the optimizer takes large
+    steps, and the resolution is refined when it converges on the current level:
+    after `patience` consecutive new layouts whose largest turbine displacement is
+    below `step_tol` or whose relative AEP change is below `rel_tol`, the next level
+    of `wind_rose_levels` is used. The last level is the full wind rose of the site,
+    so the final iterations optimize the same AEP as an unscheduled run.
+
+    The AEP changes (mostly shifts) when the level is refined, so the driver's own
+    tolerance should be tighter than `rel_tol` to not stop on a coarse level.
+
+    Parameters
+    ----------
+    site :                  PyWake site
+    n_levels (int):         number of wind rose levels
+    n_ws_coarse (int):      wind speeds of the coarsest level
+    step_tol (float):       largest turbine displacement considered converged [m]
+    rel_tol (float):        relative AEP change considered converged
+    patience (int):         consecutive converged evaluations before refining
+
+    Usage
+    -----
+    schedule = WindRoseSchedule(site, n_levels=3, step_tol=20., rel_tol=1e-3)
+    FixedBottomWindFarm(..., wind_rose_schedule=schedule)
+    schedule.history        # evaluations and AEP at each refinement
+    '''
+
+    def __init__(self, site, n_levels=3, n_ws_coarse=5, step_tol=20., rel_tol=1e-3, patience=2):
+        self.levels = wind_rose_levels(site, n_levels=n_levels, n_ws_coarse=n_ws_coarse)
+        self.step_tol = step_tol
+        self.rel_tol = rel_tol
+        self.patience = patience
+        self.level = 0
+        self.n_evaluations = 0
+        self.history = []
+        self._last = None
+        self._calm = 0
+
+    @property
+    def flow_cases(self):
+        '''wd and ws of the current level, to pass on to the AEP evaluation'''
+        return self.levels[self.level]
+
+    @property
+    def final(self):
+        return self.level == len(self.levels) - 1
+
+    def reset(self):
+        self.level = 0
+        self.n_evaluations = 0
+        self.history = []
+        self._last = None
+        self._calm = 0
+
+    def update(self, x, y, aep):
+        '''
+        Record the AEP of a new layout at the current level.
+
+        Returns
+        -------
+        refined (bool): True if the level was refined, i.e. the AEP of the
+                        layout must be evaluated again
+        '''
+        self.n_evaluations += 1
+        if self.final:
+            return False
+
+        if self._last is not None:
+            x0, y0, aep0 = self._last
+            step = np.hypot(x - x0, y - y0).max()
+            change = abs(aep - aep0)/max(abs(aep0), 1e-12)
+            converged = step < self.step_tol or change < self.rel_tol
+            self._calm = self._calm + 1 if converged else 0
+        self._last = (np.array(x, dtype=float), np.array(y, dtype=float), aep)
+
+        if self._calm < self.patience:
+            return False
+
+        self.history.append(dict(level=self.level, evaluations=self.n_evaluations, aep=aep))
+        self.level += 1
+        self._last = None
+        self._calm = 0
+        return True
@@ -0,0 +1,221 @@
+# External libraries
+import numpy as np
+from autograd import value_and_grad
+from autograd.tracer import getval
+from py_wake.utils.gradients import AutogradNumpy
+
+from wesl.optimizer.offshore_system.aep_evaluation import AEP_BYTES_PER_PAIR, GRADIENT_BYTES_PER_PAIR
+
+
+def power_curve_limits(windTurbines, ws_range=(0., 40.), resolution=0.01):
+    """
+    Cut-in, rated and cut-out wind speeds read from the turbine's power curve,
+    limited to `ws_range`.
+
+    Generic (GenericWindTurbine) power curves do not cut out, so the upper limit
+    of the range acts as cut-out.
+
+    Returns
+    -------
+    ws_cutin, ws_rated, ws_cutout (float): [m/s]
+    """
+    ws = np.arange(ws_range[0], ws_range[1] + resolution/2, resolution)
+    power = windTurbines.power(ws)
+    producing = np.flatnonzero(power > 1e-6*power.max())
+    ws_rated = ws[np.argmax(power >= (1 - 1e-6)*power.max())]
+    return ws[producing[0]], ws_rated, ws[producing[-1]]
+
+
+def _weibull_inverse_cdf(u, A, k):
+    return A*(-np.log1p(-u))**(1/k)
+
+
+def weibull_quadrature(site, windTurbines, n_nodes=6, n_nodes_above_rated=0, wd=None):
+    """
+    Per-direction wind speed quadrature of a Weibull site.
+
+    The power curve splits the wind speed range into [cut-in, rated] and
+    [rated, cut-out]. On [cut-in, rated] `n_nodes` Gauss-Legendre nodes are placed
+    in the Weibull CDF (probability) space of the direction's sector, i.e.
+
+        integral of P(ws) f(ws) dws = integral of P(F^-1(u)) du
+
+    so the Weibull density is folded into the weights and the nodes concentrate
+    where the wind blows. Above rated the free-stream power curve is flat, so by
+    default [rated, cut-out] gets no nodes: its probability is returned instead
+    and every turbine produces rated power there. This is an approximation, as a
+    waked turbine can still be below rated while the free stream is above; its
+    measured effect is in the table of `WeibullQuadratureAEP`, and
+    n_nodes_above_rated integrates the interval instead. Wind speeds
+    outside [cut-in, cut-out] produce no power and get no nodes. The limits are
+    kept inside the bins of the site's default wind speeds, which is the range
+    the dense AEP integrates.
+
+    Parameters
+    ----------
+    site :              PyWake site with Weibull_A/Weibull_k/Sector_frequency (e.g. UniformWeibullSite)
+    windTurbines :      PyWake wind turbine(s)
+    n_nodes (int):              nodes on [cut-in, rated]
+    n_nodes_above_rated (int):  nodes on [rated, cut-out], for power curves of which
+                                waked turbines are still below rated there; 0 treats
+                                the interval as flat
+    wd (float):                 wind directions, default the site's default_wd
+
+    Returns
+    -------
+    wd_t, ws_t, weight_t (float, np.array):  flow cases (direction, speed) and their
+                                             probabilities, shape
+                                             (n_wd*(n_nodes + n_nodes_above_rated),)
+    p_rated (float):                         probability of the wind speeds at rated
+                                             power without nodes (all directions)
+    """
+    wd, ws = site.get_defaults(wd, None)
+    half_bin = np.diff(ws)/2 if len(ws) > 1 else [.5]
+    ws_cutin, ws_rated, ws_cutout = power_curve_limits(windTurbines,
+                                                       (ws[0] - half_bin[0], ws[-1] + half_bin[-1]))
+
+    lw = site.local_wind(x=np.zeros(1), y=np.zeros(1),
+                         h=np.atleast_1d(windTurbines.hub_height()),
+                         wd=wd, ws=[ws_rated])
+    assert 'Weibull_A_ilk' in lw, 'Wind speed quadrature requires a Weibull site'
+    A = lw['Weibull_A_ilk'].ravel()[:, None]
+    k = lw['Weibull_k_ilk'].ravel()[:, None]
+    p_wd = np.broadcast_to(lw['Sector_frequency_ilk'], (1, len(wd), 1)).ravel()[:, None]
+
+    def cdf(ws):
+        return 1 - np.exp(-(ws/A)**k)
+
+    ws_t, weight_t = [], []
+    intervals = [(ws_cutin, ws_rated, n_nodes)]
+    p_rated = 0.
+    if ws_cutout > ws_rated:
+        if n_nodes_above_rated:
+            intervals.append((ws_rated, ws_cutout, n_nodes_above_rated))
+        else:
+            p_rated = float((p_wd*(cdf(ws_cutout) - cdf(ws_rated))).sum())
+    for ws_lo, ws_hi, n in intervals:
+        xi, gl_weight = np.polynomial.legendre.leggauss(n)
+        u_lo, u_hi = cdf(ws_lo), cdf(ws_hi)                         # (L, 1)
+        u = (u_lo + u_hi)/2 + (u_hi - u_lo)/2*xi                     # (L, n)
+        ws_t.append(_weibull_inverse_cdf(u, A, k))
+        weight_t.append(p_wd*(u_hi - u_lo)/2*gl_weight)
+
+    ws_t = np.hstack(ws_t)
+    weight_t = np.hstack(weight_t)
+    wd_t = np.repeat(wd, ws_t.shape[1])
+    return wd_t, ws_t.ravel(), weight_t.ravel(), p_rated
+
+
+class WeibullQuadratureAEP():
+    '''
+    AEP integration over per-direction Weibull quadrature nodes instead of the
+    site's dense uniform wind speed grid.
+
+    The flow cases are simulated as a PyWake time series (one wind direction and
+    speed per case) and weighted with the quadrature probabilities, so a 12-sector
+    UniformWeibullSite needs n_nodes wind speeds per direction instead of the 23 of
+    the default 3-25 m/s grid. Above rated the turbines produce rated power and no
+    flow cases are simulated (see `weibull_quadrature`).
+
+    Relative AEP error against a 0.025 m/s grid over the same 2.5-25.5 m/s range
+    (worst of three 25-63 turbine layouts at 3.3-5.5 D spacing, SG 14-222 on the
+    Vineyard Wind rose, Bastankhah) and time of one AEP and one AEP+gradient
+    evaluation of 63 turbines:
+
+        wind speeds per direction       max. error      AEP [s]     gradient [s]
+        3                               1.2e-02         0.20        1.36
+        4                               1.5e-03         0.25        1.48
+        5                               8.2e-04         0.25        1.54
+        6 (default)                     4.6e-04         0.26        1.63
+        7                               2.4e-04         0.32        2.02
+        8                               2.3e-04         0.42        3.06
+        10                              3.0e-04         0.55        4.00
+        dense grid, 23 (1 m/s bins)     1.7e-04         0.67        4.31
+
+    As many nodes again above rated (n_nodes_above_rated=n_nodes) changed none of
+    these errors in the first three digits. Beyond 6 nodes the error stops
+    decreasing steadily while the cost keeps growing, so the default is at the
+    knee of the table.
+
+    Parameters
+    ----------
+    wf_model :                  PyWake wind farm model with a Weibull site
+    n_nodes (int):              Gauss-Legendre nodes between cut-in and rated
+    n_nodes_above_rated (int):  nodes between rated and cut-out, 0 for rated power there
+    memory_GB (float):          peak memory budget; the flow cases are evaluated in blocks
+
+    Usage
+    -----
+    quadrature = WeibullQuadratureAEP(wf_model)
+    aep = quadrature.aep(x, y)
+    quadrature.error(x, y)      # against the dense wind speed grid
+    '''
+
+    def __init__(self, wf_model, n_nodes=6, n_nodes_above_rated=0, memory_GB=None):
+        self.wf_model = wf_model
+        self.n_nodes = n_nodes
+        self.n_nodes_above_rated = n_nodes_above_rated
+        self.memory_GB = memory_GB
+        self.wd_t, self.ws_t, self.weight_t, p_rated = weibull_quadrature(wf_model.site,
+                                                                          wf_model.windTurbines,
+                                                                          n_nodes=n_nodes,
+                                                                          n_nodes_above_rated=n_nodes_above_rated)
+        # AEP per turbine of the flat interval without nodes [GWh]
+        _, ws_rated, _ = power_curve_limits(wf_model.windTurbines)
+        self.rated_aep = p_rated*float(np.max(wf_model.windTurbines.power(ws_rated)))*24*365*1e-9
+
+    def _blocks(self, n_turbines, gradients):
+        T = len(self.ws_t)
+        if self.memory_GB is None:
+            return [slice(0, T)]
+        bytes_per_pair = GRADIENT_BYTES_PER_PAIR if gradients else AEP_BYTES_PER_PAIR
+        n_chunks = int(np.clip(np.ceil(n_turbines**2 * T * bytes_per_pair / 1024**3 / self.memory_GB), 1, T))
+        edges = np.linspace(0, T, n_chunks + 1).astype(int)
+        return [slice(t0, t1) for t0, t1 in zip(edges[:-1], edges[1:])]
+
+    def _block_aep(self, x, y, block):
+        _, _, power_ilk, _, _, _ = self.wf_model(x, y, wd=self.wd_t[block], ws=self.ws_t[block],
+                                                 time=True, return_simulationResult=False)
+        return (power_ilk.sum(0)[:, 0] * self.weight_t[block]).sum() * 24 * 365 * 1e-9
+
+    def aep(self, x, y):
+        '''AEP in GWh'''
+        return len(x)*self.rated_aep + sum(float(self._block_aep(x, y, block))
+                                           for block in self._blocks(len(x), gradients=False))
+
+    def aep_and_gradients(self, x, y):
+        '''AEP in GWh and its gradient wrt. [x, y], shape (2, n)'''
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        n = len(x)
+        aep, daep = n*self.rated_aep, np.zeros(2*n)
+        for block in self._blocks(n, gradients=True):
+
+            def aep_xy(xy):
+                return self._block_aep(xy[:n], xy[n:], block)
+
+            with AutogradNumpy():
+                aep_b, daep_b = value_and_grad(aep_xy)(np.concatenate((x, y)))
+            aep += float(getval(aep_b))
+            daep += np.asarray(daep_b)
+        return aep, daep.reshape(2, n)
+
+    def error(self, x, y, ws=None):
+        '''
+        Quadrature AEP against the dense uniform-grid reference.
+
+        ws: reference wind speeds, default the site's default_ws
+
+        Returns
+        -------
+        dict with both AEPs [GWh], the relative error and the number of wind speed
+        evaluations per direction of each method.
+        '''
+        _, ws = self.wf_model.site.get_defaults(None, ws)
+        aep_quadrature = self.aep(x, y)
+        aep_reference = float(self.wf_model.aep(x, y, ws=ws))
+        return dict(aep_quadrature=aep_quadrature,
+                    aep_reference=aep_reference,
+                    rel_error=(aep_quadrature - aep_reference)/aep_reference,
+                    ws_per_wd_quadrature=self.n_nodes + self.n_nodes_above_rated,
+                    ws_per_wd_reference=len(ws))
@@ -1,25 +1,18 @@
-
-import matplotlib
-matplotlib.use("TkAgg")  # or "QtAgg" if available
-import matplotlib.pyplot as plt
-
-
-
-
 import numpy as np
 import openmdao.api as om
 import xarray as xr
 import matplotlib.pyplot as plt
-from matplotlib.patches import Circle
-from wesl.optimizer.interarray.farmrepo import g1
+from matplotlib.collections import EllipseCollection, LineCollection
 
 # Heuristic Wrapper Valotta Rodrigues Perez 2024 (Mauricio Souza DTU thesis 2022)
-from wesl.optimizer.interarray.interface import heuristic_wrapper
-from wesl.optimizer.interarray.farmrepo import g1
-
-from py_wake.utils.gradients import autograd
+from wesl.optimizer.interarray.interface import CentroidHeuristicFactory
+from wesl.optimizer.offshore_system.wind_speed_quadrature import WeibullQuadratureAEP
+from wesl.optimizer.offshore_system.disk_cache import DiskCache
+from wesl.optimizer.offshore_system.aep_evaluation import (aep_and_gradients, chunked_aep, lean_wind_farm_model,
+                                                           LayoutCache, SectorPool)
+from py_wake.site.xrsite import UniformSite, UniformWeibullSite
+from py_wake.wind_farm_models.wind_farm_model import WindFarmModel
 
-plt.ion()  
 
 class FixedBottomWindFarm(om.ExplicitComponent):
 
@@ -48,6 +41,42 @@ class FixedBottomWindFarm(om.ExplicitComponent):
                                                                                  wind_turbines, 
                                                                                  k=0.0324555)),
 
+    AEP and gradient evaluations are kept in a small layout-keyed cache. By default
+    `compute` only evaluates the AEP and the gradient is computed lazily, in
+    `compute_partials`, in one autograd pass that also caches the AEP; line-search
+    evaluations (e.g. SLSQP) and gradient-free drivers (e.g. COBYLA) never pay for
+    a gradient. With fused_gradients=True `compute` gets the AEP and its gradient
+    from a single pass, so `compute_partials` at the same point costs nothing; this
+    only pays off if the driver asks for the gradient at (almost) every point, as
+    an AEP pass costs a fraction of a gradient pass (0.7 s vs 4.3 s for 63 turbines
+    on a 12-sector Weibull site). Cache counters are available from `cache_stats()`.
+
+    For cluster-scale layouts set memory_GB: AEP and gradients are then evaluated
+    over wind direction (and if needed wind speed) blocks whose estimated peak
+    memory fits the budget, and accumulated.
+
+    With n_cpu > 1 (or None for all CPUs) the wind direction blocks are farmed out
+    to a persistent process pool that keeps the wind farm model warm in each worker;
+    the pool is started on the first evaluation and closed by `prob.cleanup()`.
+
+    With lean_aep=True (default) and a uniform site, the optimization loop creates no
+    xarray objects: the AEP is the probability-weighted power sum of the wake model's
+    numpy arrays (no SimulationResult), and the site's local wind is built once.
+
+    With ws_quadrature_nodes set (Weibull sites), the wind speed integral uses that
+    many Gauss-Legendre nodes between cut-in and rated per direction (rated power
+    above) instead of the site's dense wind speed grid, see `WeibullQuadratureAEP`. Its AEP error against
+    the dense grid is reported by `self.quadrature.error(x, y)`.
+
+    With a `WindRoseSchedule` (wind_rose_schedule option) the early iterations run on
+    a coarse wind rose, and the direction and speed resolution is refined as the
+    optimizer converges; the cache is cleared and the current layout re-evaluated at
+    each refinement.
+
+    With disk_cache set to a directory, evaluations are also kept on disk (see
+    `DiskCache`) and looked up there before running the wake model, so restarts and
+    repeated runs of a script with the same site, turbines and wake model reuse them.
+
     """
 
     def initialize(self):
@@ -61,6 +90,47 @@ class FixedBottomWindFarm(om.ExplicitComponent):
                              types = int,
                              desc="number of turbines") # change here to more general
 
+        self.options.declare("fused_gradients",
+                             default=False,
+                             types=bool,
+                             desc="Evaluate AEP and its gradient together in compute")
+        self.options.declare("cache_size",
+                             default=4,
+                             types=int,
+                             desc="Number of layouts kept in the AEP/gradient cache")
+        self.options.declare("memory_GB",
+                             default=None,
+                             types=(float, int),
+                             allow_none=True,
+                             desc="Peak memory budget for chunked wake evaluation (None: no chunking)")
+        self.options.declare("n_cpu",
+                             default=1,
+                             types=int,
+                             allow_none=True,
+                             desc="Worker processes for sector-parallel AEP (None: all CPUs)")
+        self.options.declare("lean_aep",
+                             default=True,
+                             types=bool,
+                             desc="Reuse the local wind of uniform sites (no xarray objects per evaluation)")
+        self.options.declare("ws_quadrature_nodes",
+                             default=None,
+                             types=int,
+                             allow_none=True,
+                             desc="Weibull quadrature nodes below rated (None: dense wind speed grid)")
+        self.options.declare("wind_rose_schedule",
+                             default=None,
+                             allow_none=True,
+                             desc="WindRoseSchedule refining the wind rose during the optimization (None: full wind rose)")
+        self.options.declare("disk_cache",
+                             default=None,
+                             types=str,
+                             allow_none=True,
+                             desc="Directory of the persistent AEP/gradient cache (None: no disk cache)")
+        self.options.declare("disk_cache_GB",
+                             default=1.,
+                             types=(float, int),
+                             desc="Size cap of the persistent AEP/gradient cache")
+
 
     def setup(self):
         # Setting layout coordinates as inputs       
@@ -76,23 +146,144 @@ class FixedBottomWindFarm(om.ExplicitComponent):
     # Declare partial sizes explicitly
         self.declare_partials('AEP', 'x', rows=np.zeros(n_turbines, int), cols=np.arange(n_turbines))
         self.declare_partials('AEP', 'y', rows=np.zeros(n_turbines, int), cols=np.arange(n_turbines))
-        
+
+        self.cache = LayoutCache(maxsize=self.options["cache_size"])
+        self.sector_pool = None
+
+        self.schedule = self.options["wind_rose_schedule"]
+        if self.schedule is not None and (self.options["n_cpu"] != 1 or
+                                          self.options["ws_quadrature_nodes"] is not None):
+            raise ValueError("wind_rose_schedule is not supported with n_cpu != 1 or ws_quadrature_nodes")
+        if self.options["ws_quadrature_nodes"] is not None and self.options["n_cpu"] != 1:
+            raise ValueError("ws_quadrature_nodes is not supported with n_cpu != 1")
+
+        self.set_wind_farm_model(self.options["sim_res"])
+
+    def set_wind_farm_model(self, wf_model):
+        '''
+        Replace the wind farm model between driver runs (e.g. the phases of a
+        `WakeModelCascade`). Cached evaluations and the sector pool are dropped.
+        '''
+        if self.sector_pool is not None:
+            self.sector_pool.close()
+            self.sector_pool = None
+        self.cache.clear()
+
+        self.disk_cache = None
+        if self.options["disk_cache"] is not None:
+            self.disk_cache = DiskCache(self.options["disk_cache"], wf_model,
+                                        max_GB=self.options["disk_cache_GB"],
+                                        ws_quadrature_nodes=self.options["ws_quadrature_nodes"])
+
+        self.wf_model = wf_model
+        if (self.options["lean_aep"] and isinstance(wf_model, WindFarmModel) and
+                isinstance(wf_model.site, (UniformSite, UniformWeibullSite))):
+            self.wf_model = lean_wind_farm_model(wf_model)
+
+        self.quadrature = None
+        if self.options["ws_quadrature_nodes"] is not None:
+            self.quadrature = WeibullQuadratureAEP(self.wf_model,
+                                                   n_nodes=self.options["ws_quadrature_nodes"],
+                                                   memory_GB=self.options["memory_GB"])
+
+    def _get_sector_pool(self):
+        if self.options["n_cpu"] == 1:
+            return None
+        if self.sector_pool is None:
+            self.sector_pool = SectorPool(self.wf_model,
+                                          n_cpu=self.options["n_cpu"],
+                                          memory_GB=self.options["memory_GB"])
+        return self.sector_pool
+
+    def _disk_entry(self, x, y):
+        if self.disk_cache is None:
+            return {}
+        entry = self.disk_cache.load(x, y, self._flow_cases()) or {}
+        if entry:
+            self.cache.store(x, y, **entry)
+        return entry
+
+    def _store(self, x, y, **items):
+        self.cache.store(x, y, **items)
+        if self.disk_cache is not None:
+            self.disk_cache.store(x, y, self._flow_cases(), **items)
+
+    def _evaluate(self, x, y, entry=None):
+        if entry is None:
+            entry = self._disk_entry(x, y)
+        if 'aep' in entry and 'daep' in entry:
+            return entry['aep'], entry['daep']
+
+        # Single autograd pass: AEP and gradient from the same wake simulation
+        pool = self._get_sector_pool()
+        if self.quadrature is not None:
+            aep, daep = self.quadrature.aep_and_gradients(x, y)
+        elif pool is not None:
+            aep, daep = pool.aep_and_gradients(x, y)
+        else:
+            aep, daep = aep_and_gradients(self.wf_model, x, y,
+                                          memory_GB=self.options["memory_GB"],
+                                          **self._flow_cases())
+        self._store(x, y, aep=aep, daep=daep)
+        return aep, daep
+
+    def _flow_cases(self):
+        if self.schedule is None:
+            return {}
+        return dict(self.schedule.flow_cases)
+
+    def _aep(self, x, y):
+        entry = self._disk_entry(x, y)
+        if 'aep' in entry:
+            return entry['aep']
+
+        if self.options["fused_gradients"]:
+            aep, _ = self._evaluate(x, y, entry)
+            return aep
+        if self.quadrature is not None:
+            aep = self.quadrature.aep(x, y)
+        elif self._get_sector_pool() is not None:
+            aep = self.sector_pool.aep(x, y)
+        else:
+            aep = chunked_aep(self.wf_model, x, y,
+                              memory_GB=self.options["memory_GB"],
+                              **self._flow_cases())
+        self._store(x, y, aep=aep)
+        return aep
+
+    def cleanup(self):
+        if self.sector_pool is not None:
+            self.sector_pool.close()
+            self.sector_pool = None
+        super().cleanup()
+
+    def cache_stats(self):
+        stats = self.cache.stats()
+        if self.disk_cache is not None:
+            stats['disk'] = self.disk_cache.stats()
+        return stats
 
     def compute(self, inputs, outputs):
-        outputs['AEP'] = -self.options["sim_res"](inputs['x'], inputs['y']).aep().sum()
+        x, y = inputs['x'], inputs['y']
+
+        aep = self.cache.get(x, y, 'aep')
+        if aep is None:
+            aep = self._aep(x, y)
+            # Refining the wind rose invalidates everything evaluated on the coarser one
+            if self.schedule is not None and self.schedule.update(x, y, aep):
+                self.cache.clear()
+                aep = self._aep(x, y)
+
+        outputs['AEP'] = -aep
 
 
     def compute_partials(self, inputs, partials):        
-        sim_res = self.options["sim_res"]
-        x,y =inputs['x'], inputs['y']
-
-        # Compute exact gradients (PyWake)
-        daep = sim_res.aep_gradients(
-            gradient_method=autograd,
-            wrt_arg=['x', 'y'],
-            x = x,
-            y = y
-        )
+        x, y = inputs['x'], inputs['y']
+
+        # Exact gradients (PyWake autograd), reused from compute when possible
+        daep = self.cache.get(x, y, 'daep')
+        if daep is None:
+            _, daep = self._evaluate(x, y)
 
         daep_x = daep[0, :]
         daep_y = daep[1, :]
@@ -117,6 +308,14 @@ class OffshoreSystemPlot(om.ExplicitComponent):
     ----------------------------------------------------------------------------------
     User gives the following arguments when setting the OpenMDAO component:
 
+    The figure is redrawn on the driver thread at every evaluation, with the
+    matplotlib backend selected by the user (nothing is drawn on a non-interactive
+    backend such as Agg). The bathymetry, boundary, initial layout and legend are
+    drawn once and cached as background; the turbines, spacing circles (one
+    EllipseCollection), cables (one LineCollection per cable type) and text are
+    updated in place and blitted on top, so a frame does not redraw the
+    bathymetry. To keep drawing out of the optimization loop, use
+    live_view.LiveLayoutPublisher and a viewer process instead.
     """
 
     def initialize(self):
@@ -142,16 +341,21 @@ class OffshoreSystemPlot(om.ExplicitComponent):
         self.add_input('AEP', val=0.0)
 
         self.iteration = 0
-        self.circles = []
-        self.turbine_scatter = None  
-        self.cableA = None
-        self.cableB = None
+
+        # Electrical layout state, built once: substation at the turbine centroid,
+        # coordinates updated in place every iteration
+        self.cables = [(-1, 2, 1000), (-1, 4, 1500)]
+        self.electrical_layout = CentroidHeuristicFactory(n, boundary, 'CPEW', self.cables)
 
 
         # # Beginning of the plot definition
         self.fig, self.ax = plt.subplots()
-        # plt.close(self.fig)
+        # Only GUI canvases are flushed; on Agg & co the figure is left for savefig
+        self.interactive = type(self.fig.canvas).required_interactive_framework is not None
+        if self.interactive:
+            plt.ion()
         
+        # Static part of the figure: drawn once, cached as background (see _on_draw)
         # Defines the water depth map
         plt.pcolormesh(lon_grid_fine, 
                     lat_grid_fine, 
@@ -168,20 +372,12 @@ class OffshoreSystemPlot(om.ExplicitComponent):
                  c='black', 
                  linestyle = '--')
         plt.tight_layout()
-        # plt.ion()
         self.ax.scatter(x_coordinates,
                         y_coordinates, 
                         c='orange', 
                         marker = '.', 
                         s=8, 
                         label='Initial Layout')
-        self.text_box = self.ax.text(0.01, 
-                                     0.99, 
-                                     '', 
-                                     transform=self.ax.transAxes, 
-                                     verticalalignment='top', 
-                                     fontsize=10, 
-                                     bbox=dict(boxstyle='round', facecolor='white', alpha=0.7))
         self.ax.set_xlabel('X [m]')
         self.ax.set_ylabel('Y [m]')
         # self.ax.set_xlim(360000, 390000)
@@ -189,139 +385,110 @@ class OffshoreSystemPlot(om.ExplicitComponent):
  
         self.ax.set_xlim(300000, 350000)
         self.ax.set_ylim(4.54E6, 4.58E6)
+
+        # Animated part: persistent artists, updated in place every iteration
+        # (animated artists are left out of the normal draw and blitted on top of the background)
+        xy = np.column_stack((x_coordinates, y_coordinates))
+        spacing_diameter = self.options['spacing_diameter']
+        self.circles = EllipseCollection(spacing_diameter, 
+                                         spacing_diameter, 
+                                         0., 
+                                         units='xy', 
+                                         offsets=xy, 
+                                         offset_transform=self.ax.transData,
+                                         facecolors='none', 
+                                         edgecolors='gray', 
+                                         linestyles='--', 
+                                         linewidths=1)
+        self.ax.add_collection(self.circles)
+        colors = ['y', '#b87333']
+        self.cable_lines = [self.ax.add_collection(LineCollection([], colors=color, linewidths=1.2))
+                            for color in colors]
+        self.turbine_scatter = self.ax.scatter(x_coordinates,
+                                               y_coordinates,
+                                               marker = '2', 
+                                               c='black', 
+                                               label='Current Design')
+        self.substation_scatter = self.ax.scatter(x_coordinates.mean(), 
+                                                  y_coordinates.mean(), 
+                                                  label='Substation', 
+                                                  c='red')
+        self.text_box = self.ax.text(0.01, 
+                                     0.99, 
+                                     '', 
+                                     transform=self.ax.transAxes, 
+                                     verticalalignment='top', 
+                                     fontsize=10, 
+                                     bbox=dict(boxstyle='round', facecolor='white', alpha=0.7))
+        # Legend built once, before the animated flag is set (legend handles copy it)
+        self.ax.legend(loc='upper center', bbox_to_anchor=(0.5, 1.15), ncol=2, fontsize=10)
+
+        self.animated = [self.circles, *self.cable_lines, self.turbine_scatter, self.substation_scatter, self.text_box]
+        for artist in self.animated:
+            artist.set_animated(self.interactive)
+
+        self.background = None
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
         print('done')
 
+    def _on_draw(self, event):
+        # Full redraw (first frame, resize, zoom): cache the static background again
+        canvas = self.fig.canvas
+        if canvas.supports_blit:
+            self.background = canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for artist in self.animated:
+            self.ax.draw_artist(artist)
+
+    def _blit(self):
+        canvas = self.fig.canvas
+        if self.background is None:
+            # First frame (or no blitting support): full draw, which caches the background
+            canvas.draw()
+        else:
+            canvas.restore_region(self.background)
+            self._draw_animated()
+            canvas.blit(self.fig.bbox)
+        canvas.flush_events()
 
     def compute(self, inputs, outputs):
         x = inputs['x']
         y = inputs['y']
-        boundary =  self.options.declare('boundary')
         aep_init = -self.options["aep_init"]
 
         aep = inputs['AEP'].item()
 
-        spacing_radius = self.options['spacing_diameter'] / 2
-
-        # Remove previous turbine positions (except for the initial layout)
-        if self.turbine_scatter is not None:
-            self.turbine_scatter.remove()
-
-        if self.cableA is not None:
-            for line in self.cableA:
-                line.remove()
-            self.cableA = None
-
-        if self.cableB is not None:
-            for line in self.cableB:
-                line.remove()
-            self.cableB = None
-
-        # Remove old circles
-        for circ in self.circles:
-            circ.remove()
-        self.circles.clear()
-
-        self.turbine_scatter = self.ax.scatter(x,
-                                               y,
-                                               marker = '2', 
-                                               c='black', 
-                                               label='Current Design')
-
-        # Draw new spacing circles
-        for xi, yi in zip(x, y):
-            circ = Circle((xi, yi), spacing_radius, edgecolor='gray',
-                          linestyle='--', facecolor='none', linewidth=1)
-            self.ax.add_patch(circ)
-            self.circles.append(circ)
-
         # Draw electrical layout
-        VertexC = g1(x,y,boundary).horns.graph['VertexC']
-    
-        M = g1(x,y,boundary).horns.graph['M']
-
-        X, Y = np.hstack((VertexC[-1:-1 - M:-1].T, VertexC[:-M].T))
-        
-        Cables = [(-1, 2, 1000), (-1, 4, 1500)]
-        
-        cable_length = []
+        Cables = self.cables
 
-        T = heuristic_wrapper(X, Y,Cables,M,heuristic='CPEW')
+        self.electrical_layout.calccost(x, y)
+        X, Y = self.electrical_layout.get_XY()
+        T = self.electrical_layout.get_table()
 
-        T = np.array([[x[0],x[1],x[2],x[3],x[4],Cables[x[4]][2]*x[2]/1000] for x in T])
+        self.cable_length = T['length'].sum()
+        cost = np.array(Cables)[T['cable'], 2]*T['length']
+        self.total_cable_cost = round(cost.sum()*0.000001, 3)
 
-        for i in range(len(T)):
-            # print('cable in meters',T[i][2])
-            cable_length.append(T[i][2])
+        # Edge ends: 1-based vertex indices in X, Y (substation first)
+        ends_u = np.column_stack((X[T['u'] - 1], Y[T['u'] - 1]))
+        ends_v = np.column_stack((X[T['v'] - 1], Y[T['v'] - 1]))
+        for i, lines in enumerate(self.cable_lines):
+            index = T['cable'] == i
+            lines.set_segments(np.stack((ends_u[index], ends_v[index]), axis=1))
 
-        cable_length = np.array(cable_length).sum()
-
-        Cables = [(-1, 2, 1000), (-1, 4, 1500)]
-
-        ##########################################
-        cab0,cab1,cost = [],[],[]
-
-        for i in range(62): #wrong: change here to n_wt, not 62
-            if T[i][4] == 0.0:
-                cab0.append(i)
-                cost.append(Cables[0][2]*T[i][2])
-            else:
-                cab1.append(i)
-                cost.append(Cables[1][2]*T[i][2])
-
-        ##########################################
-        total_cable_cost = np.array(cost).sum()
-
-        WTcoords = np.array([x,y])
-
-        WTcentroid = np.array([WTcoords[0].mean(), WTcoords[1].mean()]) #UPDATE THIS TO MATCH REAL
-        
-        total_cable_cost =  round(total_cable_cost*0.000001, 3) 
-        
-        # plt.scatter(WTcentroid[0],WTcentroid[1],label='Substation',c='red')
-        self.ax.scatter(WTcentroid[0],WTcentroid[1],label='Substation',c='red')
-
-        # colors = ['b','g','r','c','m','y','k','bg','gr','rc','cm']
-        colors = ['y', '#b87333' ]
-
-        b = T
-
-        Cables = np.array(Cables)
-
-        for i in range(Cables.shape[0]):
-            index = b[:,4]==i
-            if index.any():
-                n1xs = X[b[index,0].astype(int)-1]
-                n2xs = X[b[index,1].astype(int)-1]
-                n1ys = Y[b[index,0].astype(int)-1]
-                n2ys = Y[b[index,1].astype(int)-1]
-                xs = np.vstack([n1xs,n2xs])
-                ys = np.vstack([n1ys,n2ys])
-
-                if i == 0:
-                    self.cableA = self.ax.plot(xs,ys,'{}'.format(colors[i]),linewidth=1.2)
-                
-                elif i == 1:
-                    self.cableB = self.ax.plot(xs,ys,'{}'.format(colors[i]),linewidth=1.2)
+        xy = np.column_stack((x, y))
+        self.turbine_scatter.set_offsets(xy)
+        self.circles.set_offsets(xy)
+        self.substation_scatter.set_offsets(xy.mean(0, keepdims=True))
 
         # Update iteration info
         self.text_box.set_text(
             f"Iteration: {self.iteration}\nAEP Improvement: {((-aep / aep_init) - 1) * 100:.3f} %"
         )
-        # plt.show()
-
-        plt.draw()
-        plt.pause(0.001) 
-        # self.ax.legend(loc='upper center', bbox_to_anchor=(0.5, 1.15), ncol=2, fontsize=10)
-        # Rebuild legend without duplicates
-        handles, labels = self.ax.get_legend_handles_labels()
-        by_label = dict(zip(labels, handles))  # removes duplicates based on label
-        self.ax.legend(by_label.values(), by_label.keys(),
-                    loc='upper center', bbox_to_anchor=(0.5, 1.15), ncol=2, fontsize=10)
-
-
-        # self.plot_electrical_layout = plot_electrical_cables1(x,y,iter=1)
 
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
+        if self.interactive:
+            self._blit()
 
         self.iteration += 1
\ No newline at end of file
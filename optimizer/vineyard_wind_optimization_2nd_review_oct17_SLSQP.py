@@ -45,6 +45,7 @@ plt.ion()   # interactive mode on
 # WESL imports
 from offshore_wind_farms.vineyard_wind import x_vineyard, y_vineyard, boundary_vineyard, SG_14222, VineyardWind
 from optimizer.constraints.wind_farm_constraints import BoundaryConstraint, PairWiseSpacing
+from optimizer.constraints.layout_repair import repair_layout
 from optimizer.offshore_system.wind_system import FixedBottomWindFarm, OffshoreSystemPlot
 
 # WESL optimizer external dependencies
@@ -82,6 +83,14 @@ sim_res = Bastankhah_PorteAgel_2014(site,                    # Wind farm model
                                     wind_turbines, 
                                     k=0.0324555)
 
+# Move the initial layout to the nearest feasible one (spacing and boundary), before
+# the initial AEP and the components are built from it
+x_coordinates, y_coordinates, repair_info = repair_layout(x_coordinates, y_coordinates,
+                                                          min_spacing = 5*wind_turbines.diameter(),
+                                                          polygon_vertices = boundary)
+print(f"Layout repair: {repair_info['iterations']} iterations, "
+      f"max. displacement {repair_info['max_displacement']:.1f} m, feasible: {repair_info['feasible']}")
+
 aep_init = sim_res(x_coordinates, y_coordinates).aep().sum() # AEP initial layout
 
 # Defining the OpenMDAO optimization problem